@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 Max Planck Society
+# License: https://bedlam.is.tuebingen.mpg.de/license.html
+#
+# Post render pipeline for BEDLAM renderings, Python version of be_post_render_pipeline.sh
+#
+# Stages (dependency graph):
+#   warmup_png: Remove warmup frames from rendered PNG image folder
+#   warmup_exr: Remove warmup frames from rendered EXR image folder
+#   movies: Generate .mp4 movies for rendered sequences (after warmup_png)
+#   camera_exr: Move auto-generated EXR camera ground truth
+#   exr: Extract depth, segmentation masks and meta information from EXR images (after warmup_exr)
+#   check_frames: Validate rendered frame ranges against be_seq.csv in render output directory, see check_sequence_frames.py (after warmup_png, warmup_exr)
+#
+# Invalid frame ranges (missing, extra or gap frames) are reported as warnings in run report and movies and EXR ground truth are still generated.
+# With --fail-on-gaps the check_frames stage fails and movies are not generated for sequences with frame gaps, in streaming mode these sequences fail before movie encoding.
+#
+# Independent stages run concurrently. Movie encoding and EXR extraction share one CPU budget.
+# Stage status is stored in JSON run report in render output directory (post_render_report.json) together with wall time and throughput per stage.
+# Stages which finished successfully in a previous run are skipped on the next run unless --force is used.
+#
+# Optional streaming mode (--streaming) moves each sequence through all stages on its own instead of running each stage for all sequences:
+#   warmup frame removal => frame range check => movie => EXR depth/masks/meta extraction => camera ground truth
+# Sequences are fed to concurrent sequence workers through bounded work queue so that ground truth of first sequences is available early in long jobs.
+# Per-sequence status is stored in run report and finished sequences are skipped on next streaming run unless --force is used. Existing movies are not encoded again.
+#
+# Usage:
+# + Run from Windows WSL2 (Python 3.10)
+# + `./be_post_render_pipeline.py /mnt/c/bedlam/images/myrenderjob 30 --yes`
+#   + Will generate 30fps MP4 movies in landscape mode (1280x720) without asking for confirmation
+# + `./be_post_render_pipeline.py /mnt/c/bedlam/images/myrenderjob 30 rotate`
+#   + Will generate 30fps MP4 movies in portrait mode (720x1280)
+# + `./be_post_render_pipeline.py /mnt/c/bedlam/images/myrenderjob 30 --yes --streaming`
+#   + Will process sequences one by one through all stages
+#
+# Requirements:
+# + ffmpeg (see `create_movies_from_images.py` for details`)
+# + OpenEXR virtual environment (see `exr_save_depth_masks.py` for details)
+#
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+import json
+import os
+from pathlib import Path
+import queue
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, List, NamedTuple
+
+from check_sequence_frames import check_render_dir, delete_files, format_result, index_sequence_frames, load_sequence_frames, PREVIEW_SUFFIX
+from check_sequence_frames import check_frames as check_frame_numbers
+from create_movies_from_images import ENCODE_PROFILES, get_output_name, make_movie
+from exr_save_depth_masks import DEPTH_FORMATS, MASK_FORMATS
+
+# Globals
+VENV_PATH = Path.home() / ".virtualenvs" / "openexr"
+SCRIPT_DIR = Path(__file__).resolve().parent
+
+REPORT_NAME = "post_render_report.json"
+LOG_DIR_NAME = "post_render_logs"
+
+MOVIE_THREADS_PER_JOB = 4
+
+# Streaming mode: CPU cores per sequence worker and maximum number of discovered sequences waiting for a worker
+STREAMING_CPU_PER_SEQUENCE = 4
+STREAMING_QUEUE_SIZE = 4
+
+class Stage(NamedTuple):
+    name: str
+    dependencies: List[str]
+    function: Callable # returns number of processed items or (number of processed items, dictionary with additional stage report entries), raises exception on failure
+    unit: str
+
+def get_cpu_count():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    else:
+        return os.cpu_count() or 1
+
+def count_sequences(image_folder, suffix):
+    # Returns (number of sequence directories, number of images)
+    num_sequences = 0
+    num_images = 0
+    with os.scandir(image_folder) as entries:
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            num_sequences += 1
+            with os.scandir(entry.path) as images:
+                num_images += sum(1 for image in images if image.name.endswith(suffix))
+    return (num_sequences, num_images)
+
+def delete_sequence_warmup_frames(sequence_dir):
+    # Delete warmup frames (images with negative frame numbers) of single sequence
+    (_, warmup_paths) = index_sequence_frames(sequence_dir)
+    return delete_files(warmup_paths)
+
+def delete_warmup_frames(image_folder):
+    # Delete all warmup frames in sequence subfolders
+    deleted = 0
+    with os.scandir(image_folder) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                deleted += delete_sequence_warmup_frames(entry.path)
+    print(f"Deleted warmup frames: {image_folder} [{deleted}]")
+    return deleted
+
+def get_frame_warnings(results):
+    # Returns list of check results with invalid frame ranges formatted as text, results: image type => check result
+    return [format_result(image_type, result) for (image_type, result) in results.items() if result["status"] not in ["OK", "UNKNOWN"]]
+
+def check_frames(render_dir, csv_path, fail_on_gaps):
+    """
+    Validate rendered frame ranges against be_seq.csv (if existing) after warmup frames were deleted.
+    Invalid frame ranges are reported as warnings unless fail_on_gaps is set.
+    Returns (number of sequences, stage report entries with warnings: sequence name => list of invalid check results).
+    """
+    sequence_frames = load_sequence_frames(csv_path) if csv_path.exists() else None
+    (report, _) = check_render_dir(render_dir, sequence_frames, warmup="skip")
+    warnings = { sequence_name: get_frame_warnings(results) for (sequence_name, results) in report.items() }
+    warnings = { sequence_name: texts for (sequence_name, texts) in warnings.items() if len(texts) > 0 }
+    if len(warnings) > 0:
+        if fail_on_gaps:
+            raise RuntimeError(f"Invalid frame ranges in {len(warnings)} sequences: {list(warnings)[:10]}, see check_sequence_frames.py for details")
+        for (sequence_name, texts) in warnings.items():
+            print(f"WARNING: Invalid frame range: {sequence_name}: {', '.join(texts)}")
+    return (len(report), { "warnings": warnings })
+
+def move_camera_exr(render_dir, sequence_name=None):
+    # Move auto-generated exr camera ground truth, optionally only for given sequence
+    camera_dir = render_dir / "ground_truth" / "camera"
+    camera_exr_dir = render_dir / "ground_truth" / "camera_exr"
+    camera_exr_dir.mkdir(parents=True, exist_ok=True)
+
+    pattern = "*_exr_*.csv" if sequence_name is None else f"*{sequence_name}*_exr_*.csv"
+    moved = 0
+    if camera_dir.exists():
+        for csv_path in sorted(camera_dir.glob(pattern)):
+            shutil.move(str(csv_path), str(camera_exr_dir / csv_path.name))
+            moved += 1
+    print(f"Moved exr camera ground truth: {camera_exr_dir} [{moved}]")
+    return moved
+
+def run_subprocess(stage_name, subprocess_args, log_dir, verbose=True):
+    # Run stage subprocess, stdout is written to stage log file, stderr is shown on console
+    log_dir.mkdir(parents=True, exist_ok=True)
+    log_path = log_dir / f"{stage_name}.log"
+    if verbose:
+        print(f"[{stage_name}] {' '.join(str(arg) for arg in subprocess_args)}")
+        print(f"[{stage_name}] Log: {log_path}")
+    with open(log_path, "w") as log_file:
+        result = subprocess.run([str(arg) for arg in subprocess_args], stdout=log_file, stdin=subprocess.DEVNULL)
+    if result.returncode != 0:
+        raise RuntimeError(f"{subprocess_args[1]} failed with exit code {result.returncode}, see {log_path}")
+
+def run_stages(stages, report, report_path, force):
+    """
+    Run stages of dependency graph. Stages are started as soon as all their dependencies finished successfully.
+    Stages which failed or have failed dependencies are reported and their dependents are not run.
+    Returns True if all stages finished successfully.
+    """
+    stage_reports = report["stages"]
+    done = set()
+    failed = set()
+    for stage in stages:
+        if (not force) and (stage_reports.get(stage.name, {}).get("status") == "done"):
+            print(f"[{stage.name}] Skipping. Stage finished in previous run.")
+            stage_reports[stage.name]["resumed"] = True
+            done.add(stage.name)
+
+    def run_stage(stage):
+        start_time = time.perf_counter()
+        result = stage.function()
+        (items, entries) = result if isinstance(result, tuple) else (result, {})
+        return (items, entries, time.perf_counter() - start_time)
+
+    pending = [stage for stage in stages if stage.name not in done]
+    running = {}
+    with ThreadPoolExecutor(max_workers=len(stages)) as executor:
+        while (len(pending) > 0) or (len(running) > 0):
+            # Start all stages with finished dependencies, skip stages with failed dependencies
+            for stage in list(pending):
+                if any(dependency in failed for dependency in stage.dependencies):
+                    print(f"[{stage.name}] ERROR: Not started because of failed dependency", file=sys.stderr)
+                    stage_reports[stage.name] = { "status": "skipped" }
+                    failed.add(stage.name)
+                    pending.remove(stage)
+                elif all(dependency in done for dependency in stage.dependencies):
+                    print(f"[{stage.name}] Starting")
+                    stage_reports[stage.name] = { "status": "running" }
+                    running[executor.submit(run_stage, stage)] = stage
+                    pending.remove(stage)
+
+            if len(running) == 0:
+                continue
+
+            (finished, _) = wait(running.keys(), return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                try:
+                    (items, entries, wall_time) = future.result()
+                    stage_reports[stage.name] = { "status": "done", "wall_time": round(wall_time, 3), "items": items, "unit": stage.unit, "throughput": round(items / wall_time, 3) if wall_time > 0 else None, **entries }
+                    done.add(stage.name)
+                    print(f"[{stage.name}] Finished: {wall_time:.1f}s, {items} {stage.unit}")
+                except Exception as e:
+                    stage_reports[stage.name] = { "status": "failed", "error": f"{type(e).__name__}: {e}" }
+                    failed.add(stage.name)
+                    print(f"[{stage.name}] ERROR: {e}", file=sys.stderr)
+
+                # Save report after each stage so that we can resume after crashes
+                save_report(report_path, report)
+
+    return len(failed) == 0
+
+def find_sequence_names(image_folder):
+    # Lazy scan of sequence directories so that first sequences are queued before the whole render directory is listed
+    with os.scandir(image_folder) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                yield entry.name
+
+def process_sequence(sequence_name, render_dir, sequence_frames, fail_on_gaps, movie_options, exr_args, log_dir):
+    """
+    Run all post render stages for a single sequence.
+    sequence_frames: Dictionary sequence name => number of frames from be_seq.csv, None to only check for gaps.
+    fail_on_gaps: Fail sequence before movie encoding if frame range is invalid instead of reporting warning.
+    Returns (dictionary with per-stage wall time, list of skipped stages, list of warnings), raises exception on failure.
+    """
+    stage_times = {}
+    skipped = []
+    warnings = []
+    image_dirs = { "png": render_dir / "png" / sequence_name, "exr": render_dir / "exr" / sequence_name }
+
+    # Delete warmup frames and validate frame ranges with single directory scan per image type, same checks as check_frames stage
+    start_time = time.perf_counter()
+    frame_numbers = {}
+    for (image_type, sequence_dir) in image_dirs.items():
+        if sequence_dir.is_dir():
+            (frame_numbers[image_type], warmup_paths) = index_sequence_frames(sequence_dir)
+            delete_files(warmup_paths)
+    stage_times["warmup"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    expected_frames = None
+    if sequence_frames is not None:
+        expected_frames = sequence_frames.get(sequence_name.removesuffix(PREVIEW_SUFFIX))
+    results = {}
+    for (image_type, numbers) in frame_numbers.items():
+        results[image_type] = check_frame_numbers(numbers, expected_frames)
+        results[image_type]["expected"] = expected_frames
+    frame_warnings = get_frame_warnings(results)
+    if len(frame_warnings) > 0:
+        if fail_on_gaps:
+            raise RuntimeError(f"Invalid frame range: {', '.join(frame_warnings)}, see check_sequence_frames.py for details")
+        print(f"WARNING: Invalid frame range: {sequence_name}: {', '.join(frame_warnings)}")
+        warnings.extend(frame_warnings)
+    stage_times["check_frames"] = time.perf_counter() - start_time
+
+    image_dir = image_dirs["png"]
+    if image_dir.is_dir():
+        output_path = render_dir / "mp4" / get_output_name(image_dir, movie_options["profile"])
+        if output_path.exists():
+            # Partial movies are removed on ffmpeg failure, see make_movie()
+            skipped.append("movie")
+        else:
+            start_time = time.perf_counter()
+            if not make_movie(image_dir, output_path, movie_options["framerate"], movie_options["rotate"], movie_options["threads"], movie_options["profile"]):
+                raise RuntimeError(f"Movie generation failed: {output_path}")
+            stage_times["movie"] = time.perf_counter() - start_time
+
+    exr_dir = image_dirs["exr"]
+    if (exr_args is not None) and exr_dir.is_dir():
+        start_time = time.perf_counter()
+        (exr_python, exr_script, exr_processes, exr_options) = exr_args
+        run_subprocess(f"exr_{sequence_name}", [exr_python, exr_script, exr_dir, render_dir, exr_processes] + exr_options, log_dir, verbose=False)
+        stage_times["exr"] = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        move_camera_exr(render_dir, sequence_name)
+        stage_times["camera_exr"] = time.perf_counter() - start_time
+
+    return (stage_times, skipped, warnings)
+
+def run_streaming(render_dir, sequence_jobs, sequence_frames, fail_on_gaps, movie_options, exr_args, log_dir, report, report_path, force):
+    """
+    Process sequences independently with concurrent sequence workers.
+    Sequence discovery is throttled by bounded work queue.
+    Returns True if all sequences finished successfully.
+    """
+    sequence_reports = report.setdefault("sequences", {})
+    work_queue = queue.Queue(maxsize=STREAMING_QUEUE_SIZE)
+    report_lock = threading.Lock()
+    failed = []
+    finished = [0]
+    start_time = time.perf_counter()
+
+    def worker():
+        while True:
+            sequence_name = work_queue.get()
+            if sequence_name is None:
+                break
+
+            sequence_start_time = time.perf_counter()
+            try:
+                (stage_times, skipped, warnings) = process_sequence(sequence_name, render_dir, sequence_frames, fail_on_gaps, movie_options, exr_args, log_dir)
+                sequence_report = { "status": "done", "wall_time": round(time.perf_counter() - sequence_start_time, 3), "stages": { name: round(value, 3) for (name, value) in stage_times.items() }, "skipped": skipped, "warnings": warnings }
+                message = f"Sequence finished: {sequence_name} [{sequence_report['wall_time']:.1f}s{', movie exists' if 'movie' in skipped else ''}]"
+            except Exception as e:
+                sequence_report = { "status": "failed", "error": f"{type(e).__name__}: {e}" }
+                message = f"ERROR: Sequence failed: {sequence_name}: {e}"
+
+            with report_lock:
+                sequence_reports[sequence_name] = sequence_report
+                if sequence_report["status"] == "done":
+                    finished[0] += 1
+                    print(f"[{finished[0]}] {message}, elapsed: {(time.perf_counter() - start_time):.0f}s")
+                else:
+                    failed.append(sequence_name)
+                    print(message, file=sys.stderr)
+                save_report(report_path, report)
+
+    workers = [threading.Thread(target=worker) for _ in range(sequence_jobs)]
+    for thread in workers:
+        thread.start()
+
+    for sequence_name in find_sequence_names(render_dir / "png"):
+        if (not force) and (sequence_reports.get(sequence_name, {}).get("status") == "done"):
+            print(f"Skipping (finished in previous run): {sequence_name}")
+            with report_lock:
+                sequence_reports[sequence_name]["resumed"] = True
+            continue
+        work_queue.put(sequence_name) # blocks while queue is full
+
+    for _ in workers:
+        work_queue.put(None)
+    for thread in workers:
+        thread.join()
+
+    if len(failed) > 0:
+        print(f"ERROR: Post render pipeline failed for {len(failed)} sequences:", file=sys.stderr)
+        for sequence_name in sorted(failed):
+            print(f"  {sequence_name}", file=sys.stderr)
+
+    return len(failed) == 0
+
+def load_report(report_path):
+    if report_path.exists():
+        with open(report_path) as f:
+            return json.load(f)
+    return { "stages": {} }
+
+def save_report(report_path, report):
+    report_path_tmp = report_path.with_suffix(".json.tmp")
+    with open(report_path_tmp, "w") as f:
+        json.dump(report, f, indent=4)
+    os.replace(report_path_tmp, report_path)
+
+################################################################################
+# Main
+################################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Post render pipeline for BEDLAM renderings")
+    parser.add_argument("render_dir", type=str, help="Render output directory with png/ and optional exr/ subdirectories")
+    parser.add_argument("framerate", type=int, nargs="?", default=30, help="Movie framerate (default: 30)")
+    parser.add_argument("rotate", nargs="?", choices=["rotate"], help="Generate movies in portrait mode")
+    parser.add_argument("--yes", action="store_true", help="Do not ask for confirmation before processing")
+    parser.add_argument("--force", action="store_true", help="Run all stages, also those which finished successfully in previous run")
+    parser.add_argument("--fail-on-gaps", action="store_true", help="Fail frame check and skip movies of sequences with invalid frame ranges instead of reporting warnings")
+    parser.add_argument("--streaming", action="store_true", help="Process each sequence through all stages on its own instead of running each stage for all sequences")
+    parser.add_argument("--cpu", type=int, default=get_cpu_count(), help="Total CPU budget shared by movie encoding and EXR extraction (default: available CPU cores)")
+    parser.add_argument("--exr-python", type=str, default=str(VENV_PATH / "bin" / "python"), help="Python interpreter with OpenEXR for EXR extraction (default: OpenEXR virtual environment)")
+    parser.add_argument("--movie-profile", choices=ENCODE_PROFILES.keys(), default="archive", help="Encode profile for movies, see create_movies_from_images.py (default: archive)")
+    parser.add_argument("--mask-format", choices=MASK_FORMATS, default="png", help="Segmentation mask output format, see exr_save_depth_masks.py (default: png)")
+    parser.add_argument("--depth-format", choices=DEPTH_FORMATS, default="exr32", help="Depth output format, see exr_save_depth_masks.py (default: exr32)")
+    args = parser.parse_intermixed_args()
+
+    render_dir = Path(args.render_dir)
+    framerate = args.framerate
+    rotate = args.rotate is not None
+    cpu_budget = max(2, args.cpu)
+
+    print(f"Processing render directory: '{render_dir}'")
+    print(f"Framerate: {framerate}")
+
+    image_folder = render_dir / "png"
+    if not image_folder.is_dir():
+        print(f"ERROR: PNG image directory not existing: '{image_folder}'", file=sys.stderr)
+        sys.exit(1)
+
+    exr_folder = render_dir / "exr"
+    have_exr = exr_folder.is_dir()
+    if not have_exr:
+        print(f"WARNING: EXR image directory not existing: '{exr_folder}'")
+
+    (num_sequences, num_images) = count_sequences(image_folder, ".png")
+    print(f"Number of rendered image sequences: {num_sequences} [Images: {num_images}]")
+    num_exr_images = 0
+    if have_exr:
+        (num_exr_sequences, num_exr_images) = count_sequences(exr_folder, ".exr")
+        print(f"Number of rendered exr sequences: {num_exr_sequences} [Images: {num_exr_images}]")
+
+    if not args.yes:
+        answer = input("Continue (y/n)?")
+        if answer != "y":
+            sys.exit(1)
+
+    # Split CPU budget between concurrent movie encoding and EXR extraction
+    movie_cpu = cpu_budget
+    exr_processes = 0
+    if have_exr:
+        exr_processes = max(1, cpu_budget // 2)
+        movie_cpu = max(1, cpu_budget - exr_processes)
+    movie_jobs = max(1, movie_cpu // MOVIE_THREADS_PER_JOB)
+    movie_threads = max(1, movie_cpu // movie_jobs)
+
+    # Streaming mode: each sequence worker runs movie encoding and EXR extraction one after another with its share of the CPU budget
+    sequence_jobs = max(1, cpu_budget // STREAMING_CPU_PER_SEQUENCE)
+    sequence_cpu = max(1, cpu_budget // sequence_jobs)
+
+    if args.streaming:
+        print(f"CPU budget: {cpu_budget} [Sequence workers: {sequence_jobs}, CPU cores per sequence: {sequence_cpu}]")
+    else:
+        print(f"CPU budget: {cpu_budget} [Movies: {movie_jobs} jobs x {movie_threads} threads, EXR: {exr_processes} processes]")
+
+    log_dir = render_dir / LOG_DIR_NAME
+    movie_folder = render_dir / "mp4"
+
+    movie_args = [sys.executable, SCRIPT_DIR / "create_movies_from_images.py", image_folder, movie_folder, framerate]
+    if rotate:
+        movie_args.append("--rotate")
+    if args.fail_on_gaps:
+        movie_args.append("--fail-on-gaps")
+    movie_args.extend(["--jobs", movie_jobs, "--threads", movie_threads, "--profile", args.movie_profile])
+
+    def run_movies():
+        run_subprocess("movies", movie_args, log_dir)
+        return num_sequences
+
+    stages = [
+        Stage("warmup_png", [], lambda: delete_warmup_frames(image_folder), "frames"),
+        Stage("movies", ["warmup_png"], run_movies, "sequences"),
+        Stage("check_frames", ["warmup_png"] + (["warmup_exr"] if have_exr else []), lambda: check_frames(render_dir, render_dir / "be_seq.csv", args.fail_on_gaps), "sequences"),
+    ]
+
+    exr_python = args.exr_python if Path(args.exr_python).exists() else sys.executable
+    exr_options = ["--mask-format", args.mask_format, "--depth-format", args.depth_format]
+
+    if have_exr:
+        exr_args = [exr_python, SCRIPT_DIR / "exr_save_depth_masks.py", exr_folder, render_dir, exr_processes] + exr_options
+
+        def run_exr():
+            run_subprocess("exr", exr_args, log_dir)
+            return count_sequences(exr_folder, ".exr")[1]
+
+        stages.extend([
+            Stage("warmup_exr", [], lambda: delete_warmup_frames(exr_folder), "frames"),
+            Stage("camera_exr", [], lambda: move_camera_exr(render_dir), "files"),
+            Stage("exr", ["warmup_exr"], run_exr, "frames"),
+        ])
+
+    report_path = render_dir / REPORT_NAME
+    report = load_report(report_path)
+    report["render_dir"] = str(render_dir)
+    report["started"] = datetime.now().isoformat(timespec="seconds")
+    report["cpu_budget"] = cpu_budget
+
+    start_time = time.perf_counter()
+    if args.streaming:
+        csv_path = render_dir / "be_seq.csv"
+        sequence_frames = load_sequence_frames(csv_path) if csv_path.exists() else None
+        movie_options = { "framerate": framerate, "rotate": rotate, "threads": sequence_cpu, "profile": args.movie_profile }
+        sequence_exr_args = (exr_python, SCRIPT_DIR / "exr_save_depth_masks.py", sequence_cpu, exr_options) if have_exr else None
+        success = run_streaming(render_dir, sequence_jobs, sequence_frames, args.fail_on_gaps, movie_options, sequence_exr_args, log_dir / "sequences", report, report_path, args.force)
+    else:
+        success = run_stages(stages, report, report_path, args.force)
+    report["wall_time"] = round(time.perf_counter() - start_time, 3)
+    save_report(report_path, report)
+
+    print(f"Run report: {report_path}")
+    if not success:
+        print("ERROR: Post render pipeline failed.", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"Post render pipeline finished successfully. Total time: {report['wall_time']:.1f}s")
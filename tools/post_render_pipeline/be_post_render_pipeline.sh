@@ -8,6 +8,8 @@
 # 2. Generate H.264 .mp4 movies for rendered sequences
 # 3. Extract depth and segmentation masks if required EXR images were generated
 #
+# Note: be_post_render_pipeline.py runs the same stages non-interactively (--yes) with concurrent movie encoding and EXR extraction, per-stage resume and JSON run report
+#
 # Usage: 
 # + Run from Windows WSL2 (Python 3.10)
 # + `bash ./be_post_render_pipeline.sh /mnt/c/bedlam/images/myrenderjob 30`
@@ -56,14 +58,9 @@ if [ ! -d "$EXR_FOLDER" ]; then
     HAVE_EXR=
 fi
 
-# Delete all warmup frames (images with negative frame numbers)
-echo "Deleting warmup frames: '$IMAGE_FOLDER'"
-find "$IMAGE_FOLDER" -maxdepth 2 -name "*-????.png" -type f -delete
-
-if [ -n "$HAVE_EXR" ]; then
-    echo "Deleting warmup frames: '$EXR_FOLDER'"
-    find "$EXR_FOLDER" -maxdepth 2 -name "*-????.exr" -type f -delete
-fi
+# Delete all warmup frames (images with negative frame numbers) and validate frame ranges against be_seq.csv
+echo "Deleting warmup frames and checking frame ranges: '$RENDER_OUTPUT_DIRECTORY'"
+python3 ./check_sequence_frames.py "$RENDER_OUTPUT_DIRECTORY"
 
 NUM_SEQUENCES=$(ls -1 $IMAGE_FOLDER | wc -l)
 NUM_IMAGES=$(find $IMAGE_FOLDER -type f -name "*.png" | wc -l)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 Max Planck Society
+# License: https://bedlam.is.tuebingen.mpg.de/license.html
+#
+# Benchmark PNG segmentation mask encoding settings of exr_save_depth_masks.py on sample EXR directory
+#
+# Masks are decoded once per frame and then encoded in memory for each setting so that only PNG encoding time is measured.
+# Reports encoding throughput and bytes per frame for each combination of PNG encoder and compression level.
+#
+# Usage: ./benchmark_mask_encoding.py INPUT_EXR_DIR [MAX_FRAMES]
+#
+# Requirements: see exr_save_depth_masks.py
+#
+
+import OpenEXR
+
+import cv2
+from pathlib import Path
+import sys
+import time
+
+from exr_save_depth_masks import MASK_CHANNELS, PNG_ENCODERS, get_image_size, get_label_map, get_manifest_masks, get_mask_image, get_png_params, read_channels
+
+# Globals
+DEFAULT_MAX_FRAMES = 20
+COMPRESSION_LEVELS = [1, 3, 6, 9]
+
+def load_masks(input_exr):
+    exr = OpenEXR.InputFile(str(input_exr))
+    header = exr.header()
+    image_size = get_image_size(header)
+
+    masks = get_manifest_masks(header)
+    if masks is None:
+        exr.close()
+        return None
+    (manifest, mask_names, _) = masks
+
+    channel_data = read_channels(exr, MASK_CHANNELS)
+    exr.close()
+
+    data_id = [channel_data[channel_name] for channel_name in MASK_CHANNELS]
+    label_map = get_label_map(manifest, mask_names, data_id)
+
+    images = []
+    for mask_index in range(len(mask_names)):
+        image_data = get_mask_image(label_map, mask_index, image_size)
+        if image_data is not None:
+            images.append(image_data)
+
+    return images
+
+################################################################################
+# Main
+################################################################################
+if __name__ == "__main__":
+    if (len(sys.argv) < 2) or (len(sys.argv) > 3):
+        print("Usage: %s INPUT_EXR_DIR [MAX_FRAMES]" % (sys.argv[0]), file=sys.stderr)
+        sys.exit(1)
+
+    input_dir = Path(sys.argv[1])
+    max_frames = DEFAULT_MAX_FRAMES
+    if len(sys.argv) == 3:
+        max_frames = int(sys.argv[2])
+
+    input_exr_files = sorted(input_dir.rglob("*.exr"))[:max_frames]
+    if len(input_exr_files) == 0:
+        print(f"ERROR: No EXR files found: {input_dir}", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"Loading masks from {len(input_exr_files)} frames: {input_dir}", file=sys.stderr)
+    frames = []
+    for input_exr_file in input_exr_files:
+        images = load_masks(input_exr_file)
+        if images is not None:
+            frames.append(images)
+
+    num_masks = sum(len(images) for images in frames)
+    print(f"Frames: {len(frames)}, Masks: {num_masks}")
+    print("Encoder,Compression,Frames/s,Masks/s,Bytes/frame")
+
+    for png_encoder in PNG_ENCODERS:
+        for png_compression in COMPRESSION_LEVELS:
+            png_params = get_png_params(png_compression, png_encoder)
+
+            total_bytes = 0
+            start_time = time.perf_counter()
+            for images in frames:
+                for image_data in images:
+                    (status, data) = cv2.imencode(".png", image_data, png_params)
+                    total_bytes += len(data)
+            encode_time = time.perf_counter() - start_time
+
+            print(f"{png_encoder},{png_compression},{len(frames)/encode_time:.1f},{num_masks/encode_time:.1f},{total_bytes/len(frames):.0f}")
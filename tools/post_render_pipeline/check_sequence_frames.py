@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 Max Planck Society
+# License: https://bedlam.is.tuebingen.mpg.de/license.html
+#
+# Remove warmup frames and validate rendered frame ranges of all sequences in render output directory
+#
+# + All frames of a sequence are indexed with single directory scan (png/<seq>/*.png, exr/<seq>/*.exr)
+# + Warmup frames (negative frame numbers, see WARMUP_FRAMES in create_level_sequences_csv.py) are deleted in bulk (--warmup delete, default)
+#   or only excluded from validation (--warmup skip)
+# + Remaining frames are checked for gaps and against frames= value of sequence Group row in be_seq.csv
+#   + Movie Render Queue renders frames [0, frames-1] with output frame step which is detected from frame numbers
+#
+# Output: One line per sequence with frame count and status (OK, MISSING, EXTRA, GAPS, UNKNOWN) for each image type, optional JSON report
+#
+# Usage: ./check_sequence_frames.py RENDER_OUTPUT_DIRECTORY [--csv BE_SEQ_CSV] [--warmup delete|skip] [--report REPORT_JSON]
+#
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import json
+import os
+from pathlib import Path
+import re
+import sys
+
+# Globals
+IMAGE_TYPES = ["png", "exr"]
+
+# Movie Render Queue image name format: {sequence_name}_{frame_number}[_preview].[png|exr], frame numbers are zero padded to 4 digits: seq_000000_-0010.png
+FRAME_PATTERN = re.compile(r"_(-?\d+)(?:_preview)?\.(?:png|exr)$")
+PREVIEW_SUFFIX = "_preview"
+
+WARMUP_MODES = ["delete", "skip"]
+DELETE_THREADS = 8 # file deletion is latency bound on network and WSL2 /mnt drives
+
+def load_sequence_frames(csv_path):
+    # Returns dictionary: sequence name => number of frames from Group rows of be_seq.csv
+    sequence_frames = {}
+    with open(csv_path, mode="r") as csv_file:
+        for row in csv.DictReader(csv_file):
+            if row["Type"] != "Group":
+                continue
+            group_config = dict(value.split("=", maxsplit=1) for value in row["Comment"].split(";") if "=" in value)
+            sequence_frames[group_config["sequence_name"]] = int(group_config["frames"])
+    return sequence_frames
+
+def index_sequence_frames(sequence_dir):
+    """
+    Index all frames of sequence directory with single os.scandir() pass.
+    Returns (sorted list of frame numbers >= 0, list of warmup frame paths).
+    """
+    frame_numbers = []
+    warmup_paths = []
+    with os.scandir(sequence_dir) as entries:
+        for entry in entries:
+            match = FRAME_PATTERN.search(entry.name)
+            if match is None:
+                continue
+            frame_number = int(match.group(1))
+            if frame_number < 0:
+                warmup_paths.append(entry.path)
+            else:
+                frame_numbers.append(frame_number)
+
+    frame_numbers.sort()
+    return (frame_numbers, warmup_paths)
+
+def delete_files(paths, threads=DELETE_THREADS):
+    if len(paths) == 0:
+        return 0
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for _ in executor.map(os.remove, paths):
+            pass
+    return len(paths)
+
+def get_frame_step(frame_numbers):
+    # Detect Movie Render Queue output frame step from smallest frame number difference
+    if len(frame_numbers) < 2:
+        return 1
+    return max(1, min(b - a for (a, b) in zip(frame_numbers[:-1], frame_numbers[1:])))
+
+def check_frames(frame_numbers, expected_frames=None):
+    """
+    Validate frame numbers of a sequence, expected_frames is number of frames from be_seq.csv or None if unknown.
+    Returns dictionary with status, number of frames, frame step and missing/extra frame numbers.
+    """
+    frame_step = get_frame_step(frame_numbers)
+    result = { "frames": len(frame_numbers), "frame_step": frame_step, "missing": [], "extra": [] }
+
+    if expected_frames is not None:
+        expected = set(range(0, expected_frames, frame_step))
+    elif len(frame_numbers) > 0:
+        expected = set(range(frame_numbers[0], frame_numbers[-1] + 1, frame_step))
+    else:
+        expected = set()
+
+    frames = set(frame_numbers)
+    result["missing"] = sorted(expected - frames)
+    result["extra"] = sorted(frames - expected)
+
+    if len(result["extra"]) > 0:
+        result["status"] = "EXTRA"
+    elif len(result["missing"]) > 0:
+        result["status"] = "MISSING" if expected_frames is not None else "GAPS"
+    elif expected_frames is None:
+        result["status"] = "UNKNOWN"
+    else:
+        result["status"] = "OK"
+    return result
+
+def check_render_dir(render_dir, sequence_frames=None, warmup="delete", image_types=IMAGE_TYPES):
+    """
+    Index, clean up and validate all sequences in render output directory.
+    sequence_frames: Dictionary sequence name => number of frames (see load_sequence_frames()), None to only check for gaps.
+    Returns (dictionary sequence name => image type => check result, number of warmup frames).
+    """
+    report = {}
+    num_warmup = 0
+    for image_type in image_types:
+        image_folder = render_dir / image_type
+        if not image_folder.is_dir():
+            continue
+
+        with os.scandir(image_folder) as entries:
+            sequence_dirs = sorted(entry.path for entry in entries if entry.is_dir())
+
+        for sequence_dir in sequence_dirs:
+            sequence_name = os.path.basename(sequence_dir)
+            (frame_numbers, warmup_paths) = index_sequence_frames(sequence_dir)
+            num_warmup += len(warmup_paths)
+            if warmup == "delete":
+                delete_files(warmup_paths)
+
+            expected_frames = None
+            if sequence_frames is not None:
+                expected_frames = sequence_frames.get(sequence_name.removesuffix(PREVIEW_SUFFIX))
+
+            result = check_frames(frame_numbers, expected_frames)
+            result["expected"] = expected_frames
+            result["warmup"] = len(warmup_paths)
+            report.setdefault(sequence_name, {})[image_type] = result
+
+    return (report, num_warmup)
+
+def format_result(image_type, result):
+    text = f"{image_type}: {result['frames']}/{result['expected'] if result['expected'] is not None else '?'} {result['status']}"
+    if result["frame_step"] != 1:
+        text += f" (step {result['frame_step']})"
+    for key in ["missing", "extra"]:
+        if len(result[key]) > 0:
+            text += f" {key}={result[key][:5]}{'...' if len(result[key]) > 5 else ''}"
+    return text
+
+################################################################################
+# Main
+################################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove warmup frames and validate rendered frame ranges")
+    parser.add_argument("render_dir", type=str, help="Render output directory with png/ and optional exr/ subdirectories")
+    parser.add_argument("--csv", type=str, default=None, help="Sequence definition file (default: RENDER_OUTPUT_DIRECTORY/be_seq.csv if existing)")
+    parser.add_argument("--warmup", choices=WARMUP_MODES, default="delete", help="Delete warmup frames (delete) or only exclude them from validation (skip)")
+    parser.add_argument("--report", type=str, default=None, help="Optional JSON report output path")
+    args = parser.parse_args()
+
+    render_dir = Path(args.render_dir)
+
+    csv_path = Path(args.csv) if args.csv is not None else render_dir / "be_seq.csv"
+    sequence_frames = None
+    if csv_path.exists():
+        sequence_frames = load_sequence_frames(csv_path)
+        print(f"Sequence definitions: {csv_path} [{len(sequence_frames)}]")
+    elif args.csv is not None:
+        print(f"ERROR: Sequence definition file not existing: {csv_path}", file=sys.stderr)
+        sys.exit(1)
+    else:
+        print(f"WARNING: No sequence definition file, only checking for frame gaps: {csv_path}")
+
+    (report, num_warmup) = check_render_dir(render_dir, sequence_frames, args.warmup)
+
+    failures = 0
+    for (sequence_name, results) in report.items():
+        status = "OK"
+        if any(result["status"] not in ["OK", "UNKNOWN"] for result in results.values()):
+            status = "ERROR"
+            failures += 1
+        print(f"{status:5} {sequence_name}: " + ", ".join(format_result(image_type, result) for (image_type, result) in results.items()))
+
+    if sequence_frames is not None:
+        not_rendered = sorted(set(sequence_frames) - set(sequence_name.removesuffix(PREVIEW_SUFFIX) for sequence_name in report))
+        if len(not_rendered) > 0:
+            failures += len(not_rendered)
+            print(f"ERROR: Sequences without rendered frames: {len(not_rendered)}: {not_rendered[:10]}{' ...' if len(not_rendered) > 10 else ''}", file=sys.stderr)
+
+    print(f"Sequences: {len(report)}, warmup frames {'deleted' if args.warmup == 'delete' else 'skipped'}: {num_warmup}, errors: {failures}")
+
+    if args.report is not None:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=4)
+
+    if failures > 0:
+        sys.exit(1)
@@ -4,80 +4,377 @@
 #
 # Create movies from image sequences
 #
-# Requirements: ffmpeg (Tested with version 4.4.2, Ubuntu 22.04)
+# Multiple sequences are encoded concurrently. Encoder threads per ffmpeg job are budgeted so that all jobs together use the available CPU cores.
+#
+# Encode profiles:
+#   archive: H.264 .mp4, high quality (default)
+#   preview: H.264 .mp4, half resolution fast encode with lower quality for QA
+#   lossless-ffv1: FFV1 .mkv, lossless RGB
+# Optional two-tier mode (--preview-tier) generates additional half resolution preview movie (_preview.mp4) from same decoded image sequence.
+#
+# Optional pipe mode (--pipe) decodes images in Python and streams raw frames into ffmpeg stdin. This allows in-memory frame processing
+# (warmup frame filtering, rotation, custom transforms) without additional pass over the images on disk.
+#
+# Requirements:
+# + ffmpeg (Tested with version 4.4.2, Ubuntu 22.04)
+# + OpenCV (4.7.0.72), only needed for pipe mode
+#   + Installation: pip install opencv-python-headless
 #
 
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.pool import ThreadPool
+import os
 from pathlib import Path
+import queue
+import re
 import subprocess
 import sys
+import tempfile
+import threading
 import time
 
-def make_movie(input_path, output_path, framerate, rotate):
+try:
+    import cv2
+    import numpy as np
+except ImportError:
+    cv2 = None # Only needed for pipe mode
+
+# Globals
+def get_cpu_count():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    else:
+        return os.cpu_count() or 1
+
+# libx264 does not scale well beyond 8-16 threads for 720p input so we prefer running more encodes in parallel
+DEFAULT_THREADS_PER_JOB = 4
+DEFAULT_JOBS = max(1, get_cpu_count() // DEFAULT_THREADS_PER_JOB)
+
+# Movie Render Queue image name format: {sequence_name}_{frame_number}[_preview].png, see create_movie_render_queue.add_render_job()
+FRAME_NUMBER_PATTERN = re.compile(r"_(-?\d+)(?:_preview)?\.png$")
+
+# Encode profiles: ffmpeg output arguments, output file extension and optional scale filter
+ENCODE_PROFILES = {
+    "archive": { "args": ["-c:v", "libx264", "-pix_fmt", "yuv420p", "-preset", "slow", "-crf", "18"], "extension": ".mp4", "scale": None },
+    "preview": { "args": ["-c:v", "libx264", "-pix_fmt", "yuv420p", "-preset", "veryfast", "-crf", "28"], "extension": ".mp4", "scale": "scale=trunc(iw/4)*2:trunc(ih/4)*2" }, # half resolution, even dimensions for yuv420p
+    "lossless-ffv1": { "args": ["-c:v", "ffv1", "-level", "3", "-pix_fmt", "bgr0", "-slices", "16", "-slicecrc", "1"], "extension": ".mkv", "scale": None },
+}
+PREVIEW_TIER_PROFILE = "preview"
+PREVIEW_TIER_SUFFIX = "_preview"
+
+# Pipe mode: image reader threads per encode and maximum number of decoded frames waiting for encoder
+PIPE_READER_THREADS = 2
+PIPE_PREFETCH_FRAMES = 16
+
+def get_output_name(image_directory, profile, suffix=""):
+    return image_directory.with_suffix("").name + suffix + ENCODE_PROFILES[profile]["extension"]
+
+def find_image_sequences(input_dir):
+    """
+    Find all directories with PNG images with single os.scandir() pass over each directory.
+    Yields (directory path, number of images, sorted list of parsed frame numbers).
+    """
+    subdirectories = []
+    num_images = 0
+    frame_numbers = []
+    with os.scandir(input_dir) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                subdirectories.append(entry.path)
+            elif entry.name.endswith(".png"):
+                num_images += 1
+                match = FRAME_NUMBER_PATTERN.search(entry.name)
+                if match is not None:
+                    frame_numbers.append(int(match.group(1)))
+
+    frame_numbers.sort()
+    yield (Path(input_dir), num_images, frame_numbers)
+
+    for subdirectory in sorted(subdirectories):
+        yield from find_image_sequences(subdirectory)
+
+def find_frame_gaps(frame_numbers):
+    # Returns list of missing frame numbers. Frame step is detected from smallest frame number difference to support Movie Render Queue output frame step.
+    if len(frame_numbers) < 2:
+        return []
+
+    frame_step = min(b - a for (a, b) in zip(frame_numbers[:-1], frame_numbers[1:]))
+    if frame_step <= 0:
+        return []
+
+    return sorted(set(range(frame_numbers[0], frame_numbers[-1] + 1, frame_step)) - set(frame_numbers))
+
+def get_image_paths(input_path, skip_warmup=False):
+    # Returns PNG images sorted by frame number, optionally without warmup frames (negative frame numbers)
+    image_paths = []
+    with os.scandir(input_path) as entries:
+        for entry in entries:
+            match = FRAME_NUMBER_PATTERN.search(entry.name)
+            if match is None:
+                continue
+            frame_number = int(match.group(1))
+            if skip_warmup and (frame_number < 0):
+                continue
+            image_paths.append( (frame_number, Path(entry.path)) )
+
+    image_paths.sort()
+    return [image_path for (_, image_path) in image_paths]
+
+def load_frame(image_path, transforms):
+    frame = cv2.imread(str(image_path), cv2.IMREAD_COLOR) # BGR
+    if frame is None:
+        raise IOError(f"Cannot read image: {image_path}")
+    for transform in transforms:
+        frame = transform(frame)
+    return np.ascontiguousarray(frame)
+
+def pipe_frames(subprocess_args, image_paths, transforms, reader_threads, prefetch_frames):
+    """
+    Decode images with reader thread pool and stream them in order as raw BGR frames into ffmpeg stdin.
+    Decoded frames are prefetched with bounded queue so that memory usage is limited to prefetch_frames frames.
+    Returns (ffmpeg exit code, ffmpeg output).
+    """
+    # Get frame size from first frame for raw video input arguments
+    first_frame = load_frame(image_paths[0], transforms)
+    (height, width) = first_frame.shape[0:2]
+    subprocess_args = [ (f"{width}x{height}" if arg == "{size}" else arg) for arg in subprocess_args ]
+
+    frame_queue = queue.Queue(maxsize=prefetch_frames)
+    stop = threading.Event()
+
+    def submit_frames(executor):
+        # None marks end of frames, queue puts are timed so that thread exits when consumer stopped with full queue
+        for image_path in image_paths[1:] + [None]:
+            future = executor.submit(load_frame, image_path, transforms) if image_path is not None else None
+            while not stop.is_set():
+                try:
+                    frame_queue.put(future, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if stop.is_set():
+                return
+
+    with tempfile.TemporaryFile() as ffmpeg_output, ThreadPoolExecutor(max_workers=reader_threads) as executor:
+        process = subprocess.Popen(subprocess_args, stdin=subprocess.PIPE, stdout=ffmpeg_output, stderr=subprocess.STDOUT)
+        submit_thread = threading.Thread(target=submit_frames, args=(executor,), daemon=True)
+        submit_thread.start()
+
+        error = None
+        try:
+            process.stdin.write(first_frame.data)
+            while True:
+                future = frame_queue.get()
+                if future is None:
+                    break
+                frame = future.result()
+                if frame.shape != first_frame.shape:
+                    raise ValueError(f"Frame size {frame.shape} differs from first frame size {first_frame.shape}")
+                process.stdin.write(frame.data)
+        except Exception as e:
+            # BrokenPipeError if ffmpeg exits early, image read and transform errors
+            error = f"{type(e).__name__}: {e}"
+            stop.set()
+            process.kill()
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+        returncode = process.wait()
+        submit_thread.join()
+
+        ffmpeg_output.seek(0)
+        output = ffmpeg_output.read().decode(errors="replace")
+        if error is not None:
+            output = f"{error}\n{output}"
+            returncode = returncode if returncode != 0 else 1
+        return (returncode, output)
+
+def make_movie(input_path, output_path, framerate, rotate, threads=0, profile="archive", preview_path=None, pipe=False, skip_warmup=False, transforms=None):
+    # pipe: Decode images in Python and stream raw frames to ffmpeg instead of using ffmpeg glob input, needed for skip_warmup and transforms
+    # transforms: Optional list of in-memory frame transforms (BGR uint8 image => BGR uint8 image), pipe mode only
 
     output_path.parent.mkdir(parents=True, exist_ok=True)
 
     # ffmpeg -y -framerate 30 -pattern_type glob -i "folder/*.png" -c:v libx264 -r 30 -pix_fmt yuv420p -preset slow -crf 18 output.mp4
     subprocess_args = ["ffmpeg"]
     subprocess_args.extend(["-y"]) # overwrite existing movie file
+    subprocess_args.extend(["-nostdin", "-loglevel", "error"]) # concurrent jobs, only show errors
     subprocess_args.extend(["-framerate", str(framerate)])
-    subprocess_args.extend(["-pattern_type", "glob"])
-    subprocess_args.extend(["-i", str(input_path / "*.png")])
 
-    if rotate:
-        subprocess_args.extend(["-vf", "transpose=clock"]) # 90 deg clockwise
+    filters = []
+    if pipe:
+        transforms = list(transforms) if transforms is not None else []
+        if rotate:
+            transforms.append(lambda frame: cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE))
+
+        # ffmpeg -f rawvideo -pix_fmt bgr24 -s 1280x720 -framerate 30 -i - ...
+        subprocess_args.extend(["-f", "rawvideo", "-pix_fmt", "bgr24", "-s", "{size}"]) # size is set from first decoded frame
+        subprocess_args.extend(["-i", "-"])
+    else:
+        subprocess_args.extend(["-pattern_type", "glob"])
+        subprocess_args.extend(["-i", str(input_path / "*.png")])
+
+        if rotate:
+            filters.append("transpose=clock") # 90 deg clockwise
 
-    subprocess_args.extend(["-c:v", "libx264"])
+    if ENCODE_PROFILES[profile]["scale"] is not None:
+        filters.append(ENCODE_PROFILES[profile]["scale"])
+
+    if preview_path is None:
+        if len(filters) > 0:
+            subprocess_args.extend(["-vf", ",".join(filters)])
+    else:
+        # Two-tier output: decode images once and split decoded frames into archive and preview encoder
+        # [0:v]transpose=clock,split=2[main][preview_in];[preview_in]scale=...[preview]
+        filter_graph = "[0:v]" + ",".join(filters + ["split=2[main][preview_in]"])
+        filter_graph += f";[preview_in]{ENCODE_PROFILES[PREVIEW_TIER_PROFILE]['scale']}[preview]"
+        subprocess_args.extend(["-filter_complex", filter_graph])
+        subprocess_args.extend(["-map", "[main]"])
+
+    subprocess_args.extend(ENCODE_PROFILES[profile]["args"])
     subprocess_args.extend(["-r", str(framerate)])
-    subprocess_args.extend(["-pix_fmt", "yuv420p"])
-    subprocess_args.extend(["-preset", "slow"])
-    subprocess_args.extend(["-crf", "18"])
+    subprocess_args.extend(["-threads", str(threads)]) # 0: automatic
     subprocess_args.extend([f"{output_path}"])
 
-    subprocess.run(subprocess_args)
+    if preview_path is not None:
+        subprocess_args.extend(["-map", "[preview]"])
+        subprocess_args.extend(ENCODE_PROFILES[PREVIEW_TIER_PROFILE]["args"])
+        subprocess_args.extend(["-r", str(framerate)])
+        subprocess_args.extend(["-threads", str(threads)])
+        subprocess_args.extend([f"{preview_path}"])
+
+    if pipe:
+        image_paths = get_image_paths(input_path, skip_warmup)
+        if len(image_paths) == 0:
+            print(f"ERROR: No images found: {input_path}", file=sys.stderr)
+            return False
+        (returncode, output) = pipe_frames(subprocess_args, image_paths, transforms, PIPE_READER_THREADS, PIPE_PREFETCH_FRAMES)
+    else:
+        result = subprocess.run(subprocess_args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        (returncode, output) = (result.returncode, result.stdout)
+
+    if returncode != 0:
+        print(f"ERROR: ffmpeg failed with exit code {returncode}: {output_path}\n{output}", file=sys.stderr)
+        # Remove partial movies so that they are not skipped on next run
+        output_path.unlink(missing_ok=True)
+        if preview_path is not None:
+            preview_path.unlink(missing_ok=True)
+        return False
 
     return True
 
+def make_movie_args(args):
+    (image_directory, output_path, *_) = args
+    start_time = time.perf_counter()
+    success = make_movie(*args)
+    return (image_directory, output_path, success, time.perf_counter() - start_time)
+
 ################################################################################
 # Main
 ################################################################################
 if __name__ == "__main__":
-    if (len(sys.argv) < 4) or (len(sys.argv) > 5):
-        print("Usage: %s INPUTDIR OUTPUTDIR FRAMERATE [rotate]" % (sys.argv[0]), file=sys.stderr)
-        sys.exit(1)
-    
-    input_dir = Path(sys.argv[1])
-    output_dir = Path(sys.argv[2])
-    framerate = int(sys.argv[3])
-    rotate = False
-    if len(sys.argv) == 5:
-        rotate = True
+    parser = argparse.ArgumentParser(description="Create H.264 .mp4 movies from PNG image sequences")
+    parser.add_argument("input_dir", type=str, help="Image input directory, contains one subdirectory per sequence")
+    parser.add_argument("output_dir", type=str, help="Movie output directory")
+    parser.add_argument("framerate", type=int, help="Movie framerate")
+    parser.add_argument("rotate_positional", nargs="?", metavar="rotate", help="Deprecated, use --rotate: any value rotates images 90 degrees clockwise (portrait mode)")
+    parser.add_argument("--rotate", action="store_true", help="Rotate images 90 degrees clockwise (portrait mode)")
+    parser.add_argument("--profile", choices=ENCODE_PROFILES.keys(), default="archive", help="Encode profile: H.264 high quality (archive), H.264 fast encode (preview), lossless FFV1 .mkv (lossless-ffv1)")
+    parser.add_argument("--preview-tier", action="store_true", help="Additionally generate half resolution preview movie (_preview.mp4) from same image decode")
+    parser.add_argument("--pipe", action="store_true", help="Decode images in Python and stream raw frames to ffmpeg (requires OpenCV)")
+    parser.add_argument("--skip-warmup", action="store_true", help="Skip warmup frames (negative frame numbers) without deleting them, requires --pipe")
+    parser.add_argument("--jobs", type=int, default=DEFAULT_JOBS, help=f"Number of concurrent ffmpeg encodes (default: {DEFAULT_JOBS})")
+    parser.add_argument("--fail-on-gaps", action="store_true", help="Report sequences with missing frame numbers as errors instead of encoding them with a warning")
+    parser.add_argument("--threads", type=int, default=0, help="Encoder threads per ffmpeg encode (default: available CPU cores divided by number of jobs)")
+    args = parser.parse_intermixed_args()
+
+    input_dir = Path(args.input_dir)
+    output_dir = Path(args.output_dir)
+    framerate = args.framerate
+    rotate = args.rotate or (args.rotate_positional is not None)
+    jobs = args.jobs
+    threads = args.threads
+    fail_on_gaps = args.fail_on_gaps
+    profile = args.profile
+    preview_tier = args.preview_tier
+    pipe = args.pipe
+    skip_warmup = args.skip_warmup
+    if skip_warmup and not pipe:
+        parser.error("--skip-warmup requires --pipe")
+    if pipe and (cv2 is None):
+        parser.error("--pipe requires OpenCV: pip install opencv-python-headless")
+    if threads <= 0:
+        threads = max(1, get_cpu_count() // jobs)
 
     print(f"Image input directory: {input_dir}")
     print(f"Movie output directory: {output_dir}")
     print(f"Framerate: {framerate}")
     print(f"Rotate images: {rotate}")
+    print(f"Encode profile: {profile}, preview tier: {preview_tier}")
+    print(f"Pipe frames: {pipe}, skip warmup frames: {skip_warmup}")
+    print(f"Concurrent encodes: {jobs}, threads per encode: {threads}")
 
     start_time = time.perf_counter()
 
-    # Get list of directories
-    image_directories = sorted(input_dir.glob("**"))
+    # Get existing movies with single directory listing
+    existing_movies = set()
+    if output_dir.is_dir():
+        with os.scandir(output_dir) as entries:
+            existing_movies = set(entry.name for entry in entries if entry.is_file())
 
-    for image_directory in image_directories:
+    tasklist = []
+    failures = []
+    for (image_directory, num_images, frame_numbers) in find_image_sequences(input_dir):
         # Skip directories without png images
-        num_images = len(list(image_directory.glob("*.png")))
         if num_images == 0:
             print(f"Skipping (no images): {image_directory}")
             continue
 
-        output_path = output_dir / image_directory.with_suffix(".mp4").name
-        if output_path.exists():
-            print(f"Skipping (mp4 exists): {output_path}")
+        output_path = output_dir / get_output_name(image_directory, profile)
+        preview_path = None
+        if preview_tier:
+            preview_path = output_dir / get_output_name(image_directory, PREVIEW_TIER_PROFILE, PREVIEW_TIER_SUFFIX)
+
+        if (output_path.name in existing_movies) and ((preview_path is None) or (preview_path.name in existing_movies)):
+            print(f"Skipping (movie exists): {output_path}")
             continue
 
-        print(f"Processing: {image_directory}")
-        success = make_movie(image_directory, output_path, framerate, rotate)
-        if not success:
-            print("ERROR! Aborting movie generation.", file=sys.stderr)
-            break
+        if skip_warmup:
+            frame_numbers = [frame_number for frame_number in frame_numbers if frame_number >= 0]
+            if len(frame_numbers) == 0:
+                print(f"Skipping (only warmup images): {image_directory}")
+                continue
+
+        frame_gaps = find_frame_gaps(frame_numbers)
+        if len(frame_gaps) > 0:
+            message_type = "ERROR" if fail_on_gaps else "WARNING"
+            print(f"{message_type}: Missing frames in {image_directory} [{frame_numbers[0]}-{frame_numbers[-1]}, {num_images} images]: {frame_gaps[:10]}{' ...' if len(frame_gaps) > 10 else ''}", file=sys.stderr)
+            if fail_on_gaps:
+                failures.append(image_directory)
+                continue
+
+        tasklist.append( (image_directory, output_path, framerate, rotate, threads, profile, preview_path, pipe, skip_warmup) )
+
+    print(f"Encoding {len(tasklist)} movies")
+    with ThreadPool(jobs) as pool:
+        for (index, (image_directory, output_path, success, encode_time)) in enumerate(pool.imap_unordered(make_movie_args, tasklist)):
+            if not success:
+                failures.append(image_directory)
+
+            finished = index + 1
+            elapsed_time = time.perf_counter() - start_time
+            eta = (elapsed_time / finished) * (len(tasklist) - finished)
+            status = "Finished" if success else "FAILED"
+            print(f"[{finished}/{len(tasklist)}] {status}: {output_path} [{encode_time:.1f}s], ETA: {eta:.0f}s")
+
+    if len(failures) > 0:
+        print(f"ERROR: Movie generation failed for {len(failures)} sequences:", file=sys.stderr)
+        for image_directory in sorted(failures):
+            print(f"  {image_directory}", file=sys.stderr)
+        sys.exit(1)
 
     print(f"Finished. Total movie generation time: {(time.perf_counter() - start_time):.1f}s")
@@ -2,7 +2,7 @@
 # Copyright (c) 2023 Max Planck Society
 # License: https://bedlam.is.tuebingen.mpg.de/license.html
 #
-# Saves depth (32-bit exr), body part segmentation masks (greyscale PNG) and camera ground truth (JSON) from Unreal Movie Render Queue raw 32-bit exr output file
+# Saves depth (32-bit exr, optional 16-bit exr or npy), body part segmentation masks (greyscale PNG) and camera ground truth (JSON) from Unreal Movie Render Queue raw 32-bit exr output file
 #
 # Generated EXR needs to be rendered without motion blur and antialiasing so that we have no partial coverage for the body parts and can use binary masks.
 #
@@ -16,6 +16,7 @@
 #
 # + OpenCV (4.7.0.72)
 #   + PNG export
+#   + Optional indexed label map mask output (--mask-format labels), see read_label_masks.py for reader
 #   + Installation: pip install opencv-python-headless
 #
 # References:
@@ -23,22 +24,117 @@
 #   + https://github.com/Synthesis-AI-Dev/exr-info
 #
 
-import OpenEXR
-import Imath
+try:
+    import OpenEXR
+    import Imath
+    import cv2
+    import numpy as np
+except ImportError:
+    OpenEXR = None # Only option constants are available, e.g. for be_post_render_pipeline.py outside of OpenEXR virtual environment
 
-import cv2
+import argparse
 import json
 from multiprocessing import Pool
-import numpy as np
+import os
 from pathlib import Path
 import struct
 import sys
 import time
 
 # Globals
-DEFAULT_PROCESSES = 16
+def get_default_processes():
+    # Use all CPU cores available to this process, leave one core for the main process which collects results
+    if hasattr(os, "sched_getaffinity"):
+        cpu_count = len(os.sched_getaffinity(0))
+    else:
+        cpu_count = os.cpu_count() or 1
+    return max(1, cpu_count - 1)
+
+DEFAULT_PROCESSES = get_default_processes()
+DEFAULT_CHUNKSIZE = 4 # Frames per dispatched pool task, small to keep progress reporting and load balancing responsive
+PROGRESS_INTERVAL = 5.0 # [s]
+
+# Batch mode resume
+#   manifest: Skip unchanged frames recorded in per-sequence completion manifest, (re)process all other frames
+#   exists: Skip outputs which already exist
+#   none: Process and overwrite all frames
+RESUME_MODES = ["manifest", "exists", "none"]
+
+DEPTH_CHANNEL = "FinalImageMovieRenderQueue_WorldDepth.R"
+
+# Cryptomatte ID levels: R and B
+# Since we render without motion blur/antialiasing we ignore the coverage values (G and A) and use simple binary mask
+MASK_CHANNELS = [f"ActorHitProxyMask{layer_index:02}.{channel_id}" for layer_index in range(0,3) for channel_id in ["R", "B"]]
+
+# Mask output formats
+#   png: One binary greyscale PNG per actor and part plus environment mask
+#   labels: One indexed label PNG per frame plus JSON sidecar which maps label values to actor index and part
+MASK_FORMATS = ["png", "labels"]
+
+# PNG mask encoding
+#   default: 8-bit greyscale PNG
+#   bilevel: 1-bit packed greyscale PNG, reads back as 0/255 8-bit greyscale image. Not used for label PNG.
+#   rle: 8-bit greyscale PNG with zlib run-length encoding strategy tuned for large uniform areas
+DEFAULT_PNG_COMPRESSION = 9
+PNG_ENCODERS = ["default", "bilevel", "rle"]
+
+# Depth output formats
+#   exr32: 32-bit float EXR with ZIP compression
+#   exr16: 16-bit half float EXR with ZIP compression. Note: Unreal depth is in [cm], distances above 65504cm (sky) are stored as infinity.
+#   npy: Uncompressed 32-bit float NumPy array (height, width), can be memory-mapped by data loaders without decoding: np.load(path, mmap_mode="r")
+DEPTH_FORMATS = ["exr32", "exr16", "npy"]
+
+def get_depth_suffix(depth_format):
+    if depth_format == "npy":
+        return "_depth.npy"
+    else:
+        return "_depth.exr"
+
+def get_png_params(png_compression, png_encoder, binary=True):
+    params = [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+    if png_encoder == "bilevel" and binary:
+        params.extend([cv2.IMWRITE_PNG_BILEVEL, 1])
+    elif png_encoder == "rle":
+        params.extend([cv2.IMWRITE_PNG_STRATEGY, cv2.IMWRITE_PNG_STRATEGY_RLE])
+    return params
+
+def get_image_size(header):
+    return (header["dataWindow"].max.x - header["dataWindow"].min.x + 1, header["dataWindow"].max.y - header["dataWindow"].min.y + 1)
+
+def read_channels(exr, channel_names):
+    """
+    Decode all requested 32-bit float channels with a single channels() call into one shared NumPy buffer.
+    Returns dictionary with a flat float32 view into the buffer for each channel name.
+    """
+    if len(channel_names) == 0:
+        return {}
+
+    image_size = get_image_size(exr.header())
+
+    # Slow operation (80% of processing time), input EXR is PIZ wavelet compressed.
+    # Calling channels() once decodes every scanline chunk only once instead of once per channel() call.
+    data_exr = exr.channels(channel_names, Imath.PixelType(Imath.PixelType.FLOAT))
+
+    data = np.empty((len(channel_names), image_size[0] * image_size[1]), dtype=np.float32)
+    channel_data = {}
+    for index, channel_name in enumerate(channel_names):
+        data[index] = np.frombuffer(data_exr[index], dtype=np.float32)
+        channel_data[channel_name] = data[index]
+
+    return channel_data
+
+def get_masks_check_path(output_path, mask_format):
+    # Output file which is always generated for a processed frame and used to check if frame was already processed
+    if mask_format == "labels":
+        return Path(str(output_path).replace(".exr", "_labels.json"))
+    else:
+        return Path(str(output_path).replace(".exr", "_env.png"))
+
+def process(input_exr, output_dir, batch_mode, mask_format="png", png_compression=DEFAULT_PNG_COMPRESSION, png_encoder="default", depth_format="exr32", overwrite=False, outputs=None):
+    # overwrite: Ignore existing output files instead of skipping them
+    # outputs: Optional list, paths of all output files for this frame are appended
+    frame_start_time = time.perf_counter()
 
-def process(input_exr, output_dir, batch_mode):
     exr = OpenEXR.InputFile(str(input_exr))
 
     if not batch_mode:
@@ -46,38 +142,50 @@ def process(input_exr, output_dir, batch_mode):
     else:
         meta_output_path = output_dir / "ground_truth" / "meta_exr" / input_exr.parent.name / input_exr.name.replace(".exr", "_meta.json")
 
-    status = process_meta(exr, meta_output_path)
+    status = process_meta(exr, meta_output_path, overwrite, outputs)
     if not status:
         exr.close()
         return False
 
     if not batch_mode:
-        depth_output_path = output_dir / "depth" / input_exr.name.replace(".exr", "_depth.exr")
+        depth_output_path = output_dir / "depth" / input_exr.name.replace(".exr", get_depth_suffix(depth_format))
     else:
-        depth_output_path = output_dir / "depth" / input_exr.parent.name / input_exr.name.replace(".exr", "_depth.exr")
-
-    status = process_depth(exr, depth_output_path)
-    if not status:
-        exr.close()
-        return False
+        depth_output_path = output_dir / "depth" / input_exr.parent.name / input_exr.name.replace(".exr", get_depth_suffix(depth_format))
 
     if not batch_mode:
         masks_output_path = output_dir / "masks" / input_exr.name
     else:
         masks_output_path = output_dir / "masks" / input_exr.parent.name / input_exr.name
 
-    status = process_masks(exr, masks_output_path)
+    # Decode all channels needed by the depth and mask export in one pass
+    channel_names = []
+    if overwrite or not depth_output_path.exists():
+        channel_names.append(DEPTH_CHANNEL)
+    if overwrite or not get_masks_check_path(masks_output_path, mask_format).exists():
+        channel_names.extend(MASK_CHANNELS)
+
+    decode_start_time = time.perf_counter()
+    channel_data = read_channels(exr, channel_names)
+    decode_time = time.perf_counter() - decode_start_time
+
+    status = process_depth(exr, channel_data, depth_output_path, depth_format, overwrite, outputs)
+    if not status:
+        exr.close()
+        return False
+
+    status = process_masks(exr, channel_data, masks_output_path, mask_format, png_compression, png_encoder, overwrite, outputs)
     if not status:
         exr.close()
         return False
 
     exr.close()
+    print(f"  Frame processing time: {(time.perf_counter() - frame_start_time):.3f}s [Decode: {decode_time:.3f}s, Channels: {len(channel_names)}]")
     return True
 
-def process_meta(exr, output_path):
+def process_meta(exr, output_path, overwrite=False, outputs=None):
 
     print("Extracting meta information")
-    if (output_path.exists()):
+    if (not overwrite) and (output_path.exists()):
         print(f"  Skipping. File exists: {output_path}")
         return True
 
@@ -102,46 +210,61 @@ def process_meta(exr, output_path):
     with open(output_path, "w") as f:
         json.dump(meta, f, indent=4)
 
+    if outputs is not None:
+        outputs.append(output_path)
+
     return True
 
-def process_depth(exr, output_path):
+def process_depth(exr, channel_data, output_path, depth_format="exr32", overwrite=False, outputs=None):
 
     print("Extracting depth data")
-    if (output_path.exists()):
+    if (not overwrite) and (output_path.exists()):
         print(f"  Skipping. File exists: {output_path}")
         return True
 
     # Check that source data is in 32-bit float
     header = exr.header()
-    pixel_type = header["channels"]["FinalImageMovieRenderQueue_WorldDepth.R"].type
+    pixel_type = header["channels"][DEPTH_CHANNEL].type
     if pixel_type != Imath.PixelType(Imath.PixelType.FLOAT):
         print(f"ERROR: Invalid pixel type: {pixel_type}")
         return False
     
-    image_size = (header["dataWindow"].max.x - header["dataWindow"].min.x + 1, header["dataWindow"].max.y - header["dataWindow"].min.y + 1)
-
-    data_exr = exr.channel("FinalImageMovieRenderQueue_WorldDepth.R") # Slow operation (0.4s out of 0.5s processing time), input EXR is PIZ wavelet compressed
-    data_np = np.frombuffer(data_exr, dtype=np.float32)
+    image_size = get_image_size(header)
 
-    header_out = OpenEXR.Header(image_size[0], image_size[1])
-    header_out["channels"] = {"Depth": Imath.Channel(Imath.PixelType(Imath.PixelType.FLOAT))}
+    data_np = channel_data[DEPTH_CHANNEL] # Decoded in single pass together with mask channels, see read_channels()
 
     if not output_path.parent.exists():
         output_path.parent.mkdir(parents=True, exist_ok=True)
 
     print(f"  Exporting: {output_path}")
-    exr_out  = OpenEXR.OutputFile(str(output_path), header_out) # Saves EXR with ZIP compression
-    exr_out.writePixels({"Depth" : data_np.tobytes()})
+    if depth_format == "npy":
+        # Write decoded buffer without additional copy or compression
+        np.save(output_path, data_np.reshape( (image_size[1], image_size[0]) ))
+    else:
+        if depth_format == "exr16":
+            pixel_type = Imath.PixelType(Imath.PixelType.HALF)
+            data_np = data_np.astype(np.float16)
+        else:
+            pixel_type = Imath.PixelType(Imath.PixelType.FLOAT)
+
+        header_out = OpenEXR.Header(image_size[0], image_size[1])
+        header_out["channels"] = {"Depth": Imath.Channel(pixel_type)}
+
+        exr_out  = OpenEXR.OutputFile(str(output_path), header_out) # Saves EXR with ZIP compression
+        exr_out.writePixels({"Depth" : data_np.tobytes()}) # OpenEXR 1.3.9 requires bytes
+        exr_out.close()
+
+    if outputs is not None:
+        outputs.append(output_path)
 
-    exr_out.close()
     return True
 
-def process_masks(exr, output_path):
+def process_masks(exr, channel_data, output_path, mask_format="png", png_compression=DEFAULT_PNG_COMPRESSION, png_encoder="default", overwrite=False, outputs=None):
 
     print("Extracting segmentation masks")
-    export_path = str(output_path).replace(".exr", "_env.png")
-    if (Path(export_path).exists()):
-        print(f"  Skipping. File exists: {export_path}")
+    check_path = get_masks_check_path(output_path, mask_format)
+    if (not overwrite) and (check_path.exists()):
+        print(f"  Skipping. File exists: {check_path}")
         return True
 
     # Find cryptomatte information
@@ -151,8 +274,61 @@ def process_masks(exr, output_path):
         print(f"ERROR: Invalid pixel type: {pixel_type}")
         return False
 
-    image_size = (header["dataWindow"].max.x - header["dataWindow"].min.x + 1, header["dataWindow"].max.y - header["dataWindow"].min.y + 1)
+    image_size = get_image_size(header)
 
+    masks = get_manifest_masks(header)
+    if masks is None:
+        return False
+    (manifest, mask_names, mask_parts) = masks
+
+    # Get cryptomatte ID channel data, decoded in single pass together with depth channel, see read_channels()
+    data_id = [channel_data[channel_name] for channel_name in MASK_CHANNELS]
+
+    """
+    # Coverage levels: G and A
+    data_coverage = []
+    for layer_index in range(0,3):
+        for channel_id in ["G", "A"]:
+            channel_name = f"ActorHitProxyMask{layer_index:02}.{channel_id}"
+            print(f"  Loading: {channel_name}")
+            data_exr = exr.channel(channel_name)
+            data_np = np.frombuffer(data_exr, dtype=np.float32)
+            data_coverage.append(data_np)
+    """
+
+    if not output_path.parent.exists():
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    mask_paths = [str(output_path).replace(".exr", f"_{mask_part}.png") for mask_part in mask_parts]
+
+    label_map = get_label_map(manifest, mask_names, data_id)
+
+    if mask_format == "labels":
+        return export_label_masks(label_map, mask_names, mask_parts, image_size, output_path, get_png_params(png_compression, png_encoder, binary=False), outputs)
+
+    png_params = get_png_params(png_compression, png_encoder)
+
+    # Export default mask
+    status = export_mask(label_map, 0, mask_names[0], image_size, mask_paths[0], png_params, outputs)
+    if not status:
+        # Default mask should always be generated even if body/clothing fully covers camera which leads to fully black mask.
+        print(f"ERROR: Cannot find data for desired mask name: {mask_names[0]}, {output_path}", file=sys.stderr)
+        return False
+
+    # Export actor masks
+    for mask_index in range(1, len(mask_names)):
+        status = export_mask(label_map, mask_index, mask_names[mask_index], image_size, mask_paths[mask_index], png_params, outputs)
+        if not status:
+            # Actor mask will not exist if actor is out of camera frame. We just issue a warning instead of aborting.
+            print(f"WARNING: Cannot find data for desired mask name (out of camera frame): {mask_names[mask_index]}, {output_path}")
+    return True
+
+def get_manifest_masks(header):
+    """
+    Get cryptomatte manifest and list of masks to export from EXR header.
+    Returns (manifest, mask_names, mask_parts) or None if no cryptomatte information is available.
+    Mask part is used as output file name suffix (env, 00_body, 00_clothing, ...).
+    """
     cryptomatte_key = None
     cryptomatte_name = None
 
@@ -166,7 +342,7 @@ def process_masks(exr, output_path):
 
     if cryptomatte_key is None:
         print("ERRROR: Cannot find cryptomatte name in file", file=sys.stderr)
-        return False
+        return None
     else:
         print(f"  Cryptomatte information found: key={cryptomatte_key}, name={cryptomatte_name}")
 
@@ -180,107 +356,273 @@ def process_masks(exr, output_path):
 
     actor_names.sort()
     
-    # Get cryptomatte channel data
-    # ID levels: R and B
-    # Since we render without motion blur/antialiasing we ignore the coverage values and use simple binary mask
-    data_id = []
-    for layer_index in range(0,3):
-        for channel_id in ["R", "B"]:
-            channel_name = f"ActorHitProxyMask{layer_index:02}.{channel_id}"
-            #print(f"  Loading channel data: {channel_name}")
-            data_exr = exr.channel(channel_name)
-            data_np = np.frombuffer(data_exr, dtype=np.float32)
-            data_id.append(data_np)
-
-    """
-    # Coverage levels: G and A
-    data_coverage = []
-    for layer_index in range(0,3):
-        for channel_id in ["G", "A"]:
-            channel_name = f"ActorHitProxyMask{layer_index:02}.{channel_id}"
-            print(f"  Loading: {channel_name}")
-            data_exr = exr.channel(channel_name)
-            data_np = np.frombuffer(data_exr, dtype=np.float32)
-            data_coverage.append(data_np)
-    """
-
-    if not output_path.parent.exists():
-        output_path.parent.mkdir(parents=True, exist_ok=True)
-
-    # Export default mask
-    mask_name = "default"
-    status = export_mask(exr, mask_name, manifest, data_id, image_size, export_path)
-    if not status:
-        # Default mask should always be generated even if body/clothing fully covers camera which leads to fully black mask.
-        print(f"ERROR: Cannot find data for desired mask name: {mask_name}, {output_path}", file=sys.stderr)
-        return False
-
-    # Export actor masks for body, clothing (optional), hair (optional)
+    # Masks to export: default (environment) mask and actor masks for body, clothing (optional), hair (optional)
+    mask_names = ["default"]
+    mask_parts = ["env"]
     for index, actor_name in enumerate(actor_names):
         for item in ["body", "clothing", "hair"]:
             mask_name = f"{actor_name}_{item}"
-            if mask_name in manifest.keys():        
-                export_path = str(output_path).replace(".exr", f"_{index:02}_{item}.png")
-                status = export_mask(exr, mask_name, manifest, data_id, image_size, export_path)
-                if not status:    
-                    # Actor mask will not exist if actor is out of camera frame. We just issue a warning instead of aborting.
-                    print(f"WARNING: Cannot find data for desired mask name (out of camera frame): {mask_name}, {output_path}")
-    return True
+            if mask_name in manifest.keys():
+                mask_names.append(mask_name)
+                mask_parts.append(f"{index:02}_{item}")
 
-def export_mask(exr, mask_name, manifest, data_id, image_size, output_path):
-    print(f"  Exporting: {mask_name}: {output_path}")
+    return (manifest, mask_names, mask_parts)
 
-    # Get object ID in float32 format
+def get_object_id(manifest, mask_name):
+    # Get object ID in float32 format, returned as uint32 bit pattern for exact comparisons
     # Note: Object ID needs to be interpreted as big-endian so that resulting float matches the data in the ID ranks.
     #       This differs from official spec which uses platform byte-order which would be little-endian.
     #       A similar approach is taken here: https://github.com/Synthesis-AI-Dev/exr-info/blob/04a51b3b943c05db6a94774c710258070d19e69a/exr_info/cryptomatte.py#L51
     object_id_hex = manifest[mask_name]
     object_id_float = struct.unpack(">f", bytes.fromhex(object_id_hex))[0]
+    return np.array(object_id_float, dtype=np.float32).view(np.uint32)
+
+def get_label_map(manifest, mask_names, data_id):
+    """
+    Build integer label images for all desired masks with one vectorized lookup per cryptomatte rank.
+    Label value is mask index + 1, zero is used for pixels without matching object ID.
+
+    Each mask is resolved from the first rank containing its object ID, matching the previous per-mask rank scan.
+    Ranks are sorted by coverage so this is rank 0 for all visible objects and later ranks are only decoded
+    into labels if they contain objects not found in earlier ranks.
 
-    num_ranks = len(data_id)
-    for rank_index in range(num_ranks):
-        rank_data_id = data_id[rank_index]
+    Returns list of (label_image, present) tuples per used rank and per-mask index into this list (-1 if not found).
+    """
+    object_ids = np.array([get_object_id(manifest, mask_name) for mask_name in mask_names], dtype=np.uint32)
+    sort_order = np.argsort(object_ids)
+    object_ids_sorted = object_ids[sort_order]
+    labels_sorted = (sort_order + 1).astype(np.uint16)
+
+    label_images = []
+    mask_label_image = np.full(len(mask_names), -1, dtype=np.int32)
+
+    for rank_data_id in data_id:
+        if np.all(mask_label_image >= 0):
+            break
 
         # Skip checks if current rank has no data
         if not np.any(rank_data_id):
             continue
 
-        rank_objectid_found = rank_data_id[:] == object_id_float # Generate binary mask, True if pixel float value matches object id float
+        # Map each pixel float ID to compact mask label with binary search on sorted manifest IDs
+        rank_ids = rank_data_id.view(np.uint32)
+        search_index = np.searchsorted(object_ids_sorted, rank_ids)
+        search_index[search_index == len(object_ids_sorted)] = 0
+        label_image = np.where(object_ids_sorted[search_index] == rank_ids, labels_sorted[search_index], 0).astype(np.uint16)
+
+        present = np.bincount(label_image, minlength=len(mask_names) + 1)[1:] > 0
+        new_masks = present & (mask_label_image < 0)
+        if np.any(new_masks):
+            mask_label_image[new_masks] = len(label_images)
+            label_images.append(label_image)
+
+    return (label_images, mask_label_image)
+
+def export_label_masks(label_map, mask_names, mask_parts, image_size, output_path, png_params, outputs=None):
+    """
+    Export all masks of a frame as single indexed label PNG (8-bit or 16-bit depending on number of labels) and JSON sidecar.
+    Label value 0 is used for pixels without any mask, label value n maps to mask_names[n-1].
+    """
+    (label_images, mask_label_image) = label_map
+
+    # Combine label images of all used ranks.
+    # Masks only found in later ranks can overlap with masks from earlier ranks since an indexed label image only stores one label per pixel.
+    # We keep the label from the earliest (highest coverage) rank in this case.
+    label_image = np.zeros(image_size[0] * image_size[1], dtype=np.uint16)
+    for label_image_index, rank_label_image in enumerate(label_images):
+        rank_labels = np.flatnonzero(mask_label_image == label_image_index) + 1
+        pixels = np.isin(rank_label_image, rank_labels) & (label_image == 0)
+        label_image[pixels] = rank_label_image[pixels]
+
+    if len(mask_names) <= np.iinfo(np.uint8).max:
+        label_image = label_image.astype(np.uint8)
+
+    label_image = label_image.reshape( (image_size[1], image_size[0]) )
+
+    labels = {}
+    for mask_index, mask_name in enumerate(mask_names):
+        if (mask_index > 0) and (mask_label_image[mask_index] < 0):
+            # Actor mask will not exist if actor is out of camera frame. We just issue a warning instead of aborting.
+            print(f"WARNING: Cannot find data for desired mask name (out of camera frame): {mask_name}, {output_path}")
+            continue
+
+        (actor_index, part) = (None, mask_parts[mask_index])
+        if mask_index > 0:
+            (actor_index, part) = part.split("_", maxsplit=1)
+            actor_index = int(actor_index)
+
+        labels[str(mask_index + 1)] = { "name": mask_name, "mask": mask_parts[mask_index], "actor_index": actor_index, "part": part }
+
+    export_path = str(output_path).replace(".exr", "_labels.png")
+    print(f"  Exporting: labels: {export_path}")
+    cv2.imwrite(export_path, label_image, png_params)
+
+    # Write sidecar last since it is used to check if frame was already processed
+    sidecar_path = get_masks_check_path(output_path, "labels")
+    print(f"  Exporting: labels sidecar: {sidecar_path}")
+    with open(sidecar_path, "w") as f:
+        json.dump({ "image": Path(export_path).name, "width": image_size[0], "height": image_size[1], "labels": labels }, f, indent=4)
 
-        if np.any(rank_objectid_found):
-            image_data = rank_objectid_found.reshape( (image_size[1], image_size[0]) )
-            image_data = image_data.astype(np.uint8)
-            image_data *= 255
-            cv2.imwrite(output_path, image_data, [cv2.IMWRITE_PNG_COMPRESSION, 9]) # write as greyscale PNG with max compression
-            return True
+    if outputs is not None:
+        outputs.extend([Path(export_path), sidecar_path])
+
+    return True
+
+def get_mask_image(label_map, mask_index, image_size):
+    # Returns binary greyscale mask image (0/255) or None if mask has no data
+    (label_images, mask_label_image) = label_map
+    label_image_index = mask_label_image[mask_index]
+    if label_image_index < 0:
+        return None
+
+    # Generate binary mask, True if pixel label matches mask label
+    image_data = label_images[label_image_index] == (mask_index + 1)
+    image_data = image_data.reshape( (image_size[1], image_size[0]) )
+    image_data = image_data.astype(np.uint8)
+    image_data *= 255
+    return image_data
+
+def export_mask(label_map, mask_index, mask_name, image_size, output_path, png_params, outputs=None):
+    print(f"  Exporting: {mask_name}: {output_path}")
 
-    # Environment mask might be zero if body/clothing fully covers it. Write black image in this case to ensure that we always have an environment mask.
-    if mask_name == "default":
+    image_data = get_mask_image(label_map, mask_index, image_size)
+    if (image_data is None) and (mask_name == "default"):
+        # Environment mask might be zero if body/clothing fully covers it. Write black image in this case to ensure that we always have an environment mask.
         image_data = np.zeros((image_size[1], image_size[0]), dtype=np.uint8)
-        cv2.imwrite(output_path, image_data, [cv2.IMWRITE_PNG_COMPRESSION, 9]) # write as greyscale PNG with max compression
-        return True
 
-    return False
+    if image_data is None:
+        return False
+
+    cv2.imwrite(output_path, image_data, png_params) # write as greyscale PNG
+
+    if outputs is not None:
+        outputs.append(Path(output_path))
+
+    return True
+
+################################################################################
+# Completion manifest for incremental batch processing
+#
+# One JSON file per sequence which records size and modification time of each processed input EXR
+# together with the list of generated output files and their sizes.
+# Frames are only recorded after all their outputs were written successfully so that frames with
+# truncated outputs from crashed runs are processed again. Unchanged recorded frames are skipped
+# without checking their output files.
+################################################################################
+def get_completion_manifest_path(output_dir, sequence_name):
+    return output_dir / "ground_truth" / "exr_manifest" / f"{sequence_name}.json"
+
+def load_completion_manifest(manifest_path, options):
+    # Returns dictionary of recorded frames, empty if manifest does not exist or was generated with different options
+    if not manifest_path.exists():
+        return {}
+
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"WARNING: Ignoring invalid completion manifest: {manifest_path}, {e}", file=sys.stderr)
+        return {}
+
+    if manifest.get("options") != options:
+        print(f"WARNING: Ignoring completion manifest generated with different options: {manifest_path}", file=sys.stderr)
+        return {}
+
+    return manifest["frames"]
+
+def save_completion_manifest(manifest_path, options, frames):
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Atomic replace so that crash during write does not leave truncated manifest
+    manifest_path_tmp = manifest_path.with_suffix(".json.tmp")
+    with open(manifest_path_tmp, "w") as f:
+        json.dump({ "options": options, "frames": frames }, f, indent=1)
+    os.replace(manifest_path_tmp, manifest_path)
+
+def find_modified_exr_files(input_dir, output_dir, options, manifests, skipped):
+    """
+    Yields (input_exr, mtime_ns, size) for all EXR files which are not recorded with same size and modification time in their sequence completion manifest.
+    Completion manifests are loaded into manifests dictionary (sequence name => recorded frames) on first use, skipped frames are appended to skipped list.
+    """
+    for input_exr in find_exr_files(input_dir):
+        sequence_name = input_exr.parent.name
+        if sequence_name not in manifests:
+            manifests[sequence_name] = load_completion_manifest(get_completion_manifest_path(output_dir, sequence_name), options)
+
+        stat = input_exr.stat()
+        frame = manifests[sequence_name].get(input_exr.name)
+        if (frame is not None) and (frame["mtime_ns"] == stat.st_mtime_ns) and (frame["size"] == stat.st_size):
+            skipped.append(input_exr)
+            continue
+
+        yield (input_exr, stat.st_mtime_ns, stat.st_size)
+
+def process_manifest_args(task):
+    # Process frame with overwrite of existing outputs and return completion manifest entry with sizes of generated output files
+    (args, mtime_ns, size) = task
+    (input_exr, output_dir) = args[0:2]
+    outputs = []
+    frame = None
+    try:
+        status = process(*args, overwrite=True, outputs=outputs)
+        error = None if status else "Processing error"
+        if status:
+            frame = { "mtime_ns": mtime_ns, "size": size, "outputs": { str(output_path.relative_to(output_dir)): output_path.stat().st_size for output_path in outputs } }
+    except Exception as e:
+        status = False
+        error = f"{type(e).__name__}: {e}"
+    return (input_exr, status, error, frame)
 
 def process_args(args):
-    return process(*args)
+    # Report per-file failures instead of aborting the whole pool on unexpected exceptions
+    input_exr = args[0]
+    try:
+        status = process(*args)
+        error = None if status else "Processing error"
+    except Exception as e:
+        status = False
+        error = f"{type(e).__name__}: {e}"
+    return (input_exr, status, error, None)
+
+def find_exr_files(input_dir):
+    # Lazy directory walk so that processing starts before the whole render directory is scanned
+    with os.scandir(input_dir) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                yield from find_exr_files(entry.path)
+            elif entry.name.endswith(".exr"):
+                yield Path(entry.path)
 
 
 ################################################################################
 # Main
 ################################################################################
 if __name__ == "__main__":
-    if (len(sys.argv) < 3) or (len(sys.argv) > 4):
-        print("Usage: %s INPUT_EXR OUTPUT_ROOT_DIR" % (sys.argv[0]), file=sys.stderr) # single file mode, input ends with .exr
-        print("Usage: %s INPUT_EXR_DIR OUTPUT_ROOT_DIR [NUM_PROCESSES]" % (sys.argv[0]), file=sys.stderr) # batch mode
+    parser = argparse.ArgumentParser(description="Save depth, segmentation masks and meta information from Unreal Movie Render Queue multilayer EXR files")
+    parser.add_argument("input", type=str, help="Input EXR file (single file mode) or input EXR directory (batch mode)")
+    parser.add_argument("output", type=str, help="Output root directory")
+    parser.add_argument("processes", type=int, nargs="?", default=DEFAULT_PROCESSES, help=f"Number of processes in batch mode (default: {DEFAULT_PROCESSES})")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help=f"Number of frames per dispatched task in batch mode (default: {DEFAULT_CHUNKSIZE})")
+    parser.add_argument("--resume", choices=RESUME_MODES, default="manifest", help="Batch mode resume: skip frames recorded in per-sequence completion manifest (manifest), skip frames with existing output files (exists) or process all frames (none)")
+    parser.add_argument("--mask-format", choices=MASK_FORMATS, default="png", help="Segmentation mask output format: binary PNG per actor and part (png) or indexed label PNG with JSON sidecar per frame (labels)")
+    parser.add_argument("--depth-format", choices=DEPTH_FORMATS, default="exr32", help="Depth output format: 32-bit float EXR (exr32), 16-bit half float EXR (exr16) or uncompressed memory-mappable NumPy array (npy)")
+    parser.add_argument("--png-compression", type=int, choices=range(0, 10), default=DEFAULT_PNG_COMPRESSION, metavar="[0-9]", help=f"PNG zlib compression level for mask export (default: {DEFAULT_PNG_COMPRESSION})")
+    parser.add_argument("--png-encoder", choices=PNG_ENCODERS, default="default", help="PNG mask encoding: 8-bit greyscale (default), 1-bit packed greyscale (bilevel) or zlib run-length encoding strategy (rle)")
+    args = parser.parse_args()
+
+    if OpenEXR is None:
+        print("ERROR: OpenEXR, OpenCV and NumPy are required, see Requirements", file=sys.stderr)
         sys.exit(1)
-    
-    input_exr = Path(sys.argv[1])
-    output_dir = Path(sys.argv[2])
 
-    processes = DEFAULT_PROCESSES
-    if len(sys.argv) >= 4:
-        processes = int(sys.argv[3])
+    input_exr = Path(args.input)
+    output_dir = Path(args.output)
+    processes = args.processes
+    chunksize = args.chunksize
+    resume = args.resume
+    mask_format = args.mask_format
+    png_compression = args.png_compression
+    png_encoder = args.png_encoder
+    depth_format = args.depth_format
 
     batch_mode = False
     if input_exr.is_dir():
@@ -288,23 +630,62 @@ if __name__ == "__main__":
 
     start_time = time.perf_counter()
 
+    failures = []
     if not batch_mode:
         # Process single EXR file
-        results = [process(input_exr, output_dir, False)]
+        if not process(input_exr, output_dir, False, mask_format, png_compression, png_encoder, depth_format):
+            failures.append( (input_exr, "Processing error") )
     else:
-        # Batch mode
-        input_exr_files = sorted(input_exr.rglob("*.exr"))
-        tasklist = []
-        for input_exr_file in input_exr_files:
-            tasklist.append( (input_exr_file, output_dir, True) )
-
-        print(f"Starting pool with {processes} processes\n")
-        pool = Pool(processes)
-        results = pool.map(process_args, tasklist)
-
-    if False not in results:
+        # Batch mode, stream tasks to pool while input files are discovered and report results as soon as they are available
+        skipped = []
+        manifests = {}
+        manifests_modified = set()
+        manifest_options = { "mask_format": mask_format, "png_compression": png_compression, "png_encoder": png_encoder, "depth_format": depth_format }
+        if resume == "manifest":
+            tasks = ( ((input_exr_file, output_dir, True, mask_format, png_compression, png_encoder, depth_format), mtime_ns, size) for (input_exr_file, mtime_ns, size) in find_modified_exr_files(input_exr, output_dir, manifest_options, manifests, skipped) )
+            process_function = process_manifest_args
+        else:
+            tasks = ( (input_exr_file, output_dir, True, mask_format, png_compression, png_encoder, depth_format, resume == "none") for input_exr_file in find_exr_files(input_exr) )
+            process_function = process_args
+
+        print(f"Starting pool with {processes} processes, chunksize {chunksize}\n")
+        processed = 0
+        progress_time = time.perf_counter()
+        with Pool(processes) as pool:
+            for (input_exr_file, status, error, frame) in pool.imap_unordered(process_function, tasks, chunksize=chunksize):
+                processed += 1
+                if not status:
+                    failures.append( (input_exr_file, error) )
+                    print(f"ERROR: {input_exr_file}: {error}", file=sys.stderr)
+
+                if resume == "manifest":
+                    sequence_name = input_exr_file.parent.name
+                    if frame is not None:
+                        manifests[sequence_name][input_exr_file.name] = frame
+                    else:
+                        manifests[sequence_name].pop(input_exr_file.name, None)
+                    manifests_modified.add(sequence_name)
+
+                current_time = time.perf_counter()
+                if (current_time - progress_time) >= PROGRESS_INTERVAL:
+                    progress_time = current_time
+                    print(f"  Progress: {processed} frames [{processed / (current_time - start_time):.1f} frames/s], skipped: {len(skipped)}, errors: {len(failures)}", file=sys.stderr)
+
+                    # Save completion state regularly so that we can resume after crashes
+                    for sequence_name in manifests_modified:
+                        save_completion_manifest(get_completion_manifest_path(output_dir, sequence_name), manifest_options, manifests[sequence_name])
+                    manifests_modified.clear()
+
+        for sequence_name in manifests_modified:
+            save_completion_manifest(get_completion_manifest_path(output_dir, sequence_name), manifest_options, manifests[sequence_name])
+
+        print(f"  Processed: {processed} frames [{processed / (time.perf_counter() - start_time):.1f} frames/s], skipped (unchanged): {len(skipped)}", file=sys.stderr)
+
+    if len(failures) == 0:
         print("EXR processing finished successfully.", file=sys.stderr)
         print(f"  Total conversion time: {(time.perf_counter() - start_time):.1f}s", file=sys.stderr)
     else:
-        print("ERROR: EXR processing errors.", file=sys.stderr)
+        print(f"ERROR: EXR processing errors: {len(failures)}", file=sys.stderr)
+        for (input_exr_file, error) in sorted(failures):
+            print(f"  {input_exr_file}: {error}", file=sys.stderr)
         sys.exit(1)
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 Max Planck Society
+# License: https://bedlam.is.tuebingen.mpg.de/license.html
+#
+# Pack per-frame depth maps and segmentation masks generated by exr_save_depth_masks.py (batch mode) into one memory-mappable container per sequence
+#
+# Input:
+#   OUTPUT_ROOT_DIR/depth/seq_000000/seq_000000_0000_depth.[exr|npy]
+#   OUTPUT_ROOT_DIR/masks/seq_000000/seq_000000_0000_[env|00_body|...].png or seq_000000_0000_labels.[png|json]
+#
+# Output:
+#   OUTPUT_ROOT_DIR/packed/seq_000000/depth_0000.npy:  float32 (frames, height, width), contiguous depth frames, one file per chunk of CHUNK_FRAMES frames
+#   OUTPUT_ROOT_DIR/packed/seq_000000/labels_0000.npy: uint8/uint16 (frames, height, width), label map stack, 0: no mask, one file per chunk
+#   OUTPUT_ROOT_DIR/packed/seq_000000/index.json: frame index (frame names and numbers), chunk files, label values for each mask (env, 00_body, 00_clothing, ...)
+#                                                 and source files (name => [mtime_ns, size]) used for packing
+#
+# Frames are written one by one into the memory-mapped output arrays so that memory usage does not depend on sequence length.
+# Existing packed sequences are only rebuilt when their source files were added, removed or modified since packing.
+# See read_packed_sequence.py for reader with random frame access.
+#
+# Usage: ./pack_sequences.py OUTPUT_ROOT_DIR [NUM_PROCESSES]
+#
+# Requirements:
+# + OpenEXR (1.3.9), only needed for EXR depth input, see exr_save_depth_masks.py for installation
+# + OpenCV (4.7.0.72)
+#   + Installation: pip install opencv-python-headless
+#
+
+try:
+    import OpenEXR
+    import Imath
+except ImportError:
+    OpenEXR = None # PNG/NPY depth and mask input can be packed without OpenEXR virtual environment
+
+import cv2
+import json
+from multiprocessing import Pool
+import numpy as np
+import os
+from pathlib import Path
+import re
+import sys
+import time
+
+from exr_save_depth_masks import get_default_processes
+from read_label_masks import LabelMasks
+
+# Globals
+DEFAULT_PROCESSES = get_default_processes()
+
+PACKED_DIR = "packed"
+INDEX_NAME = "index.json"
+INDEX_VERSION = 2
+DEPTH_NAME = "depth_{chunk:04d}.npy"
+LABELS_NAME = "labels_{chunk:04d}.npy"
+CHUNK_FRAMES = 256
+
+DEPTH_PATTERN = re.compile(r"^(?P<frame>.+)_depth\.(?P<format>exr|npy)$")
+MASK_PATTERN = re.compile(r"^(?P<frame>.+)_(?P<mask>env|\d+_(?:body|clothing|hair))\.png$")
+LABELS_PATTERN = re.compile(r"^(?P<frame>.+)_labels\.json$")
+
+def get_frame_number(frame_name):
+    return int(frame_name.rsplit("_", maxsplit=1)[1])
+
+def load_depth(depth_path):
+    if depth_path.suffix == ".npy":
+        return np.load(depth_path, mmap_mode="r")
+
+    exr = OpenEXR.InputFile(str(depth_path))
+    header = exr.header()
+    width = header["dataWindow"].max.x - header["dataWindow"].min.x + 1
+    height = header["dataWindow"].max.y - header["dataWindow"].min.y + 1
+    data_exr = exr.channel("Depth", Imath.PixelType(Imath.PixelType.FLOAT))
+    exr.close()
+    return np.frombuffer(data_exr, dtype=np.float32).reshape( (height, width) )
+
+def scan_sequence_dir(sequence_dir):
+    # Returns list of directory entries, empty if directory does not exist
+    if not sequence_dir.exists():
+        return []
+
+    with os.scandir(sequence_dir) as entries:
+        return [ entry for entry in entries if entry.is_file() ]
+
+def find_sequence_files(entries, pattern):
+    # Returns dictionary: frame name => list of (pattern groups, path)
+    files = {}
+    for entry in entries:
+        match = pattern.match(entry.name)
+        if match is None:
+            continue
+        groups = match.groupdict()
+        frame_name = groups.pop("frame")
+        files.setdefault(frame_name, []).append( (groups, Path(entry.path)) )
+    return files
+
+def get_sources(output_dir, entries):
+    # Source file (relative to output directory) => [mtime_ns, size]
+    sources = {}
+    for entry in entries:
+        stat = entry.stat()
+        sources[Path(entry.path).relative_to(output_dir).as_posix()] = [stat.st_mtime_ns, stat.st_size]
+    return dict(sorted(sources.items()))
+
+def load_index(index_path):
+    # Returns existing index or None if missing or unreadable
+    if not index_path.exists():
+        return None
+
+    try:
+        with open(index_path) as f:
+            return json.load(f)
+    except json.JSONDecodeError:
+        return None
+
+def write_chunks(packed_dir, name, dtype, shape, chunk_frames):
+    # Returns list of (path, temporary path, memory-mapped chunk array)
+    chunks = []
+    num_frames = shape[0]
+    for (chunk, start) in enumerate(range(0, num_frames, chunk_frames)):
+        path = packed_dir / name.format(chunk=chunk)
+        path_tmp = path.with_name(path.name + ".tmp")
+        frames = min(chunk_frames, num_frames - start)
+        chunks.append( (path, path_tmp, np.lib.format.open_memmap(path_tmp, mode="w+", dtype=dtype, shape=(frames, ) + shape[1:])) )
+    return chunks
+
+def finish_chunks(chunks):
+    # Returns list of chunk file names
+    names = []
+    for (path, path_tmp, data) in chunks:
+        data.flush()
+        del data
+        os.replace(path_tmp, path)
+        names.append(path.name)
+    return names
+
+def pack_sequence(output_dir, sequence_name):
+    packed_dir = output_dir / PACKED_DIR / sequence_name
+    index_path = packed_dir / INDEX_NAME
+
+    depth_entries = scan_sequence_dir(output_dir / "depth" / sequence_name)
+    mask_entries = scan_sequence_dir(output_dir / "masks" / sequence_name)
+    sources = get_sources(output_dir, depth_entries + mask_entries)
+
+    old_index = load_index(index_path)
+    if (old_index is not None) and (old_index.get("version") == INDEX_VERSION) and (old_index.get("sources") == sources):
+        print(f"Skipping. Packed sequence is up to date: {index_path}")
+        return True
+
+    depth_files = find_sequence_files(depth_entries, DEPTH_PATTERN)
+    mask_files = find_sequence_files(mask_entries, MASK_PATTERN)
+    labels_files = find_sequence_files(mask_entries, LABELS_PATTERN)
+
+    frame_names = sorted(set(depth_files) | set(mask_files) | set(labels_files), key=get_frame_number)
+    if len(frame_names) == 0:
+        print(f"ERROR: No frames found for sequence: {sequence_name}", file=sys.stderr)
+        return False
+
+    if (OpenEXR is None) and any(groups["format"] == "exr" for files in depth_files.values() for (groups, _) in files):
+        print(f"ERROR: OpenEXR is required for EXR depth input of sequence: {sequence_name}, see Requirements", file=sys.stderr)
+        return False
+
+    # Label map sidecars are parsed once, label images are only decoded when frame is packed
+    sidecars = { frame_name: LabelMasks(files[0][1]) for (frame_name, files) in labels_files.items() }
+
+    # Per-sequence label values, sorted by mask name with environment first
+    mask_names = set()
+    for frame_name in frame_names:
+        for (groups, _) in mask_files.get(frame_name, []):
+            mask_names.add(groups["mask"])
+        if frame_name in sidecars:
+            mask_names.update(sidecars[frame_name].keys())
+    mask_names = sorted(mask_names, key=lambda mask_name: (mask_name != "env", mask_name))
+    mask_labels = { mask_name: (index + 1) for (index, mask_name) in enumerate(mask_names) }
+
+    # Get image size from first frame
+    first_frame = frame_names[0]
+    if first_frame in depth_files:
+        (height, width) = load_depth(depth_files[first_frame][0][1]).shape
+    elif first_frame in sidecars:
+        (height, width) = (sidecars[first_frame].height, sidecars[first_frame].width)
+    else:
+        (height, width) = cv2.imread(str(mask_files[first_frame][0][1]), cv2.IMREAD_GRAYSCALE).shape
+
+    if old_index is None:
+        print(f"Packing: {sequence_name}, frames={len(frame_names)}, size={width}x{height}, masks={len(mask_names)}")
+    else:
+        print(f"Repacking: {sequence_name}, source files changed, frames={len(frame_names)}, size={width}x{height}, masks={len(mask_names)}")
+    packed_dir.mkdir(parents=True, exist_ok=True)
+
+    # Remove index first so that an interrupted repack leaves sequence incomplete. Chunks are written to temporary files, index is written last and marks sequence as complete.
+    index_path.unlink(missing_ok=True)
+
+    shape = (len(frame_names), height, width)
+    depth_chunks = []
+    if len(depth_files) > 0:
+        depth_chunks = write_chunks(packed_dir, DEPTH_NAME, np.float32, shape, CHUNK_FRAMES)
+
+    labels_chunks = []
+    if len(mask_names) > 0:
+        labels_dtype = np.uint8 if len(mask_names) <= np.iinfo(np.uint8).max else np.uint16
+        labels_chunks = write_chunks(packed_dir, LABELS_NAME, labels_dtype, shape, CHUNK_FRAMES)
+
+    for (frame_index, frame_name) in enumerate(frame_names):
+        (chunk, chunk_index) = divmod(frame_index, CHUNK_FRAMES)
+
+        if len(depth_chunks) > 0:
+            depth = depth_chunks[chunk][2]
+            if frame_name in depth_files:
+                depth[chunk_index] = load_depth(depth_files[frame_name][0][1])
+            else:
+                print(f"WARNING: Missing depth for frame: {frame_name}")
+                depth[chunk_index] = np.inf
+
+        if len(labels_chunks) > 0:
+            # Masks of a frame do not overlap unless a mask was only found in lower coverage cryptomatte ranks, keep first label in this case
+            label_image = labels_chunks[chunk][2][chunk_index]
+            label_image[:] = 0
+            if frame_name in sidecars:
+                frame_labels = sidecars.pop(frame_name) # release decoded label image after use
+                lookup = np.zeros(max(frame_labels.labels.values()) + 1, dtype=label_image.dtype)
+                for (mask_name, label) in frame_labels.labels.items():
+                    lookup[label] = mask_labels[mask_name]
+                label_image[:] = lookup[frame_labels.label_image]
+            elif frame_name in mask_files:
+                for (groups, mask_path) in sorted(mask_files[frame_name], key=lambda item: mask_labels[item[0]["mask"]]):
+                    mask = cv2.imread(str(mask_path), cv2.IMREAD_GRAYSCALE) > 0
+                    label_image[mask & (label_image == 0)] = mask_labels[groups["mask"]]
+            else:
+                print(f"WARNING: Missing masks for frame: {frame_name}")
+
+    index = {
+        "version": INDEX_VERSION,
+        "sequence_name": sequence_name,
+        "width": width,
+        "height": height,
+        "frames": frame_names,
+        "frame_numbers": [get_frame_number(frame_name) for frame_name in frame_names],
+        "chunk_frames": CHUNK_FRAMES,
+        "depth": finish_chunks(depth_chunks) if len(depth_chunks) > 0 else None,
+        "labels": finish_chunks(labels_chunks) if len(labels_chunks) > 0 else None,
+        "masks": mask_labels,
+        "sources": sources
+    }
+
+    # Remove chunks of previous packing which are not part of new index
+    packed_names = set((index["depth"] or []) + (index["labels"] or []))
+    for path in packed_dir.glob("*.npy"):
+        if path.name not in packed_names:
+            path.unlink()
+
+    with open(index_path, "w") as f:
+        json.dump(index, f, indent=4)
+
+    return True
+
+def pack_sequence_args(args):
+    return pack_sequence(*args)
+
+################################################################################
+# Main
+################################################################################
+if __name__ == "__main__":
+    if (len(sys.argv) < 2) or (len(sys.argv) > 3):
+        print("Usage: %s OUTPUT_ROOT_DIR [NUM_PROCESSES]" % (sys.argv[0]), file=sys.stderr)
+        sys.exit(1)
+
+    output_dir = Path(sys.argv[1])
+
+    processes = DEFAULT_PROCESSES
+    if len(sys.argv) == 3:
+        processes = int(sys.argv[2])
+
+    start_time = time.perf_counter()
+
+    sequence_names = set()
+    for data_dir in [output_dir / "depth", output_dir / "masks"]:
+        if data_dir.exists():
+            sequence_names.update(path.name for path in data_dir.iterdir() if path.is_dir())
+
+    tasklist = [ (output_dir, sequence_name) for sequence_name in sorted(sequence_names) ]
+    print(f"Packing {len(tasklist)} sequences with {processes} processes\n")
+    with Pool(processes) as pool:
+        results = pool.map(pack_sequence_args, tasklist)
+
+    if False not in results:
+        print("Packing finished successfully.", file=sys.stderr)
+        print(f"  Total packing time: {(time.perf_counter() - start_time):.1f}s", file=sys.stderr)
+    else:
+        print("ERROR: Packing errors.", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 Max Planck Society
+# License: https://bedlam.is.tuebingen.mpg.de/license.html
+#
+# Read indexed label map segmentation masks generated by `exr_save_depth_masks.py --mask-format labels`
+#
+# Each frame has one label PNG (8-bit or 16-bit) and a JSON sidecar which maps label values to actor index and part:
+#   seq_000000_0000_labels.png
+#   seq_000000_0000_labels.json
+#
+# Usage as module:
+#   masks = LabelMasks("masks/seq_000000/seq_000000_0000_labels.json")
+#   env_mask = masks["env"]     # binary mask (uint8, 0/255), label PNG is only decoded on first access
+#   for (mask_name, mask) in masks.items(): ...
+#
+# Usage as script (expand label map into per-actor binary PNG masks with same names as default PNG mask output):
+#   ./read_label_masks.py INPUT_LABELS_JSON_OR_DIR OUTPUT_DIR
+#
+# Requirements:
+# + OpenCV (4.7.0.72)
+#   + Installation: pip install opencv-python-headless
+#
+
+import cv2
+import json
+import numpy as np
+from pathlib import Path
+import sys
+
+class LabelMasks:
+    def __init__(self, sidecar_path):
+        self.sidecar_path = Path(sidecar_path)
+        with open(self.sidecar_path) as f:
+            sidecar = json.load(f)
+
+        self.image_path = self.sidecar_path.parent / sidecar["image"]
+        self.width = sidecar["width"]
+        self.height = sidecar["height"]
+
+        # Mask name (env, 00_body, 00_clothing, ...) => label value
+        self.labels = {}
+        # Mask name => label information (name, actor_index, part)
+        self.info = {}
+        for (label, label_info) in sidecar["labels"].items():
+            self.labels[label_info["mask"]] = int(label)
+            self.info[label_info["mask"]] = label_info
+
+        self._label_image = None
+
+    @property
+    def label_image(self):
+        # Lazy decode of label PNG on first access
+        if self._label_image is None:
+            self._label_image = cv2.imread(str(self.image_path), cv2.IMREAD_UNCHANGED)
+            if self._label_image is None:
+                raise IOError(f"Cannot read label image: {self.image_path}")
+        return self._label_image
+
+    def keys(self):
+        return self.labels.keys()
+
+    def __contains__(self, mask_name):
+        return mask_name in self.labels
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, mask_name):
+        # Binary mask in same format as default PNG mask output (uint8, 0/255)
+        mask = (self.label_image == self.labels[mask_name]).astype(np.uint8)
+        mask *= 255
+        return mask
+
+    def items(self):
+        for mask_name in self.labels.keys():
+            yield (mask_name, self[mask_name])
+
+def expand_label_masks(sidecar_path, output_dir):
+    masks = LabelMasks(sidecar_path)
+    frame_name = masks.sidecar_path.name.replace("_labels.json", "")
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for (mask_name, mask) in masks.items():
+        output_path = output_dir / f"{frame_name}_{mask_name}.png"
+        print(f"  Exporting: {output_path}")
+        cv2.imwrite(str(output_path), mask, [cv2.IMWRITE_PNG_COMPRESSION, 9])
+
+################################################################################
+# Main
+################################################################################
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: %s INPUT_LABELS_JSON_OR_DIR OUTPUT_DIR" % (sys.argv[0]), file=sys.stderr)
+        sys.exit(1)
+
+    input_path = Path(sys.argv[1])
+    output_dir = Path(sys.argv[2])
+
+    if input_path.is_dir():
+        for sidecar_path in sorted(input_path.rglob("*_labels.json")):
+            expand_label_masks(sidecar_path, output_dir / sidecar_path.parent.relative_to(input_path))
+    else:
+        expand_label_masks(input_path, output_dir)
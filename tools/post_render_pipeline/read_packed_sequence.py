@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 Max Planck Society
+# License: https://bedlam.is.tuebingen.mpg.de/license.html
+#
+# Read per-sequence depth and label map containers generated by pack_sequences.py
+#
+# Depth and label stacks are stored in chunks of frames. Each chunk is opened as np.memmap so that random frame access only reads the requested frame from disk without decoding.
+#
+# Usage as module:
+#   sequence = PackedSequence("packed/seq_000000")
+#   depth = sequence.depth[10]                  # float32 (height, width), view into memory-mapped chunk file
+#   labels = sequence.labels[10]                # uint8/uint16 (height, width)
+#   mask = sequence.get_mask(10, "00_body")     # binary mask (uint8, 0/255)
+#   index = sequence.get_frame_index(42)        # frame number => frame index
+#
+# Usage as script (print sequence information): ./read_packed_sequence.py PACKED_SEQUENCE_DIR
+#
+# Requirements: numpy
+#
+
+import json
+import numpy as np
+from pathlib import Path
+import sys
+
+class ChunkedFrames:
+    # Read-only frame stack over memory-mapped chunk files, indexing with frame index returns view into chunk
+    def __init__(self, paths, chunk_frames):
+        self.chunks = [ np.load(path, mmap_mode="r") for path in paths ]
+        self.chunk_frames = chunk_frames
+        self.dtype = self.chunks[0].dtype
+        self.shape = (sum(len(chunk) for chunk in self.chunks), ) + self.chunks[0].shape[1:]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, frame_index):
+        if frame_index < 0:
+            frame_index += len(self)
+        if (frame_index < 0) or (frame_index >= len(self)):
+            raise IndexError(f"Frame index out of range: {frame_index}")
+        (chunk, chunk_index) = divmod(frame_index, self.chunk_frames)
+        return self.chunks[chunk][chunk_index]
+
+class PackedSequence:
+    def __init__(self, sequence_dir):
+        self.sequence_dir = Path(sequence_dir)
+        with open(self.sequence_dir / "index.json") as f:
+            index = json.load(f)
+
+        self.sequence_name = index["sequence_name"]
+        self.width = index["width"]
+        self.height = index["height"]
+        self.frames = index["frames"]
+        self.frame_numbers = index["frame_numbers"]
+        self.masks = index["masks"] # mask name (env, 00_body, ...) => label value
+
+        self._frame_indices = { frame_number: frame_index for (frame_index, frame_number) in enumerate(self.frame_numbers) }
+
+        self.depth = None
+        if index["depth"] is not None:
+            self.depth = ChunkedFrames([self.sequence_dir / name for name in index["depth"]], index["chunk_frames"])
+
+        self.labels = None
+        if index["labels"] is not None:
+            self.labels = ChunkedFrames([self.sequence_dir / name for name in index["labels"]], index["chunk_frames"])
+
+    def __len__(self):
+        return len(self.frames)
+
+    def get_frame_index(self, frame_number):
+        return self._frame_indices[frame_number]
+
+    def get_mask(self, frame_index, mask_name):
+        # Binary mask in same format as default PNG mask output (uint8, 0/255)
+        mask = (self.labels[frame_index] == self.masks[mask_name]).astype(np.uint8)
+        mask *= 255
+        return mask
+
+################################################################################
+# Main
+################################################################################
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: %s PACKED_SEQUENCE_DIR" % (sys.argv[0]), file=sys.stderr)
+        sys.exit(1)
+
+    sequence = PackedSequence(sys.argv[1])
+    print(f"Sequence: {sequence.sequence_name}")
+    print(f"  Frames: {len(sequence)} [{sequence.frame_numbers[0]}-{sequence.frame_numbers[-1]}], Size: {sequence.width}x{sequence.height}")
+    if sequence.depth is not None:
+        print(f"  Depth: {sequence.depth.dtype}, {sequence.depth.shape}")
+    if sequence.labels is not None:
+        print(f"  Labels: {sequence.labels.dtype}, {sequence.labels.shape}, Masks: {', '.join(sequence.masks.keys())}")
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 Max Planck Society
+# License: https://bedlam.is.tuebingen.mpg.de/license.html
+#
+# Fake renderer for testing watch_render_output.py: fills target render directory with frames of an existing render job
+#
+# Sequences are "rendered" one after another like Movie Render Queue does. For each frame the PNG and EXR images are written
+# in two halves with a pause in between so that the watcher sees incomplete files.
+# Camera ground truth CSV files (ground_truth/camera/*.csv) of a sequence are copied after its last frame.
+#
+# Usage: ./simulate_render_output.py SOURCE_RENDER_DIR TARGET_RENDER_DIR [FRAME_INTERVAL]
+#
+
+from pathlib import Path
+import shutil
+import sys
+import time
+
+# Globals
+DEFAULT_FRAME_INTERVAL = 0.5 # [s]
+
+def write_slowly(source_path, target_path, pause):
+    data = source_path.read_bytes()
+    half = len(data) // 2
+    with open(target_path, "wb") as f:
+        f.write(data[:half])
+        f.flush()
+        time.sleep(pause)
+        f.write(data[half:])
+
+################################################################################
+# Main
+################################################################################
+if __name__ == "__main__":
+    if (len(sys.argv) < 3) or (len(sys.argv) > 4):
+        print("Usage: %s SOURCE_RENDER_DIR TARGET_RENDER_DIR [FRAME_INTERVAL]" % (sys.argv[0]), file=sys.stderr)
+        sys.exit(1)
+
+    source_dir = Path(sys.argv[1])
+    target_dir = Path(sys.argv[2])
+    frame_interval = DEFAULT_FRAME_INTERVAL
+    if len(sys.argv) == 4:
+        frame_interval = float(sys.argv[3])
+
+    sequence_names = set()
+    for image_type in ["png", "exr"]:
+        if (source_dir / image_type).is_dir():
+            sequence_names.update(path.name for path in (source_dir / image_type).iterdir() if path.is_dir())
+
+    for sequence_name in sorted(sequence_names):
+        print(f"Rendering: {sequence_name}")
+        frames = []
+        for image_type in ["png", "exr"]:
+            sequence_dir = source_dir / image_type / sequence_name
+            if sequence_dir.is_dir():
+                frames.extend(sorted(sequence_dir.glob(f"*.{image_type}")))
+                (target_dir / image_type / sequence_name).mkdir(parents=True, exist_ok=True)
+
+        # Render both image types of a frame together, frames sorted by name
+        for source_path in sorted(frames, key=lambda path: path.stem):
+            target_path = target_dir / source_path.relative_to(source_dir)
+            write_slowly(source_path, target_path, frame_interval / 2)
+            time.sleep(frame_interval / 2)
+
+        camera_dir = source_dir / "ground_truth" / "camera"
+        if camera_dir.is_dir():
+            target_camera_dir = target_dir / "ground_truth" / "camera"
+            target_camera_dir.mkdir(parents=True, exist_ok=True)
+            for csv_path in camera_dir.glob(f"*{sequence_name}*.csv"):
+                shutil.copy(csv_path, target_camera_dir / csv_path.name)
+
+    print("Rendering finished")
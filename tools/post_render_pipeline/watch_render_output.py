@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 Max Planck Society
+# License: https://bedlam.is.tuebingen.mpg.de/license.html
+#
+# Watch render output directory while Movie Render Queue is still rendering and post-process frames as soon as they are completed
+#
+# + Rendered EXR frames (exr/<seq>/*.exr) are processed with exr_save_depth_masks.process() once their size and modification time are stable
+#   + Processed frames are recorded in the per-sequence completion manifest so that a later exr_save_depth_masks.py batch run skips them
+# + Warmup frames (negative frame numbers) are deleted once they are stable
+# + Sequence is finalized when no frames were added or modified for --sequence-timeout seconds and all its EXR frames are processed
+#   + Movie encode is started and auto-generated EXR camera ground truth is moved to ground_truth/camera_exr
+#   + Existing movies are kept unless sequence received new frames while watching, so restarting the watcher on finished render directory does not encode movies again
+#   + If new frames show up after finalization (re-render) the sequence is finalized again
+#
+# Watcher runs until interrupted (Ctrl+C) or until render directory was idle for --exit-idle seconds and all work is finished.
+# Use simulate_render_output.py to fill a local directory with frames of an existing render job for testing.
+#
+# Usage:
+# + `./watch_render_output.py /mnt/c/bedlam/images/myrenderjob 30`
+# + `./watch_render_output.py /mnt/c/bedlam/images/myrenderjob 30 rotate --exit-idle 600`
+#
+# Requirements:
+# + ffmpeg (see `create_movies_from_images.py` for details`)
+# + OpenEXR virtual environment (see `exr_save_depth_masks.py` for details)
+#
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+import os
+from pathlib import Path
+import sys
+import time
+
+from be_post_render_pipeline import move_camera_exr
+from check_sequence_frames import FRAME_PATTERN
+from create_movies_from_images import DEFAULT_JOBS, DEFAULT_THREADS_PER_JOB, ENCODE_PROFILES, get_output_name, make_movie
+from exr_save_depth_masks import DEFAULT_PNG_COMPRESSION, DEFAULT_PROCESSES, DEPTH_FORMATS, MASK_FORMATS, PNG_ENCODERS, OpenEXR, get_completion_manifest_path, load_completion_manifest, process_manifest_args, save_completion_manifest
+
+# Globals
+POLL_INTERVAL = 2.0 # [s]
+DEFAULT_STABLE_TIME = 5.0 # [s], minimum age of unchanged frame file before it is processed
+DEFAULT_SEQUENCE_TIMEOUT = 120.0 # [s], sequence without new frames for this time is finalized
+
+class SequenceState:
+    def __init__(self, name, manifest):
+        self.name = name
+        self.manifest = manifest # processed EXR frames: file name => completion manifest entry
+        self.file_stats = {} # file path => (mtime_ns, size) from previous poll
+        self.submitted = set() # EXR file names currently processed
+        self.failed = {} # EXR file name => (mtime_ns, size) of failed processing, retried only when file changes
+        self.last_activity = time.time()
+        self.scanned = False # first scan only records existing frames
+        self.new_frames = False # frames were added or modified since first scan and sequence was not finalized since
+        self.finalized = False
+        self.manifest_modified = False
+
+def scan_frames(sequence_dir, suffix):
+    # Returns dictionary: file path => (mtime_ns, size)
+    frames = {}
+    if not sequence_dir.is_dir():
+        return frames
+
+    with os.scandir(sequence_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith(suffix) and entry.is_file():
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue # deleted during scan
+                frames[entry.path] = (stat.st_mtime_ns, stat.st_size)
+    return frames
+
+def is_stable(previous_stat, stat, now, stable_time):
+    # Frame is stable if it did not change since last poll and was not modified for stable_time seconds
+    (mtime_ns, size) = stat
+    return (previous_stat == stat) and (size > 0) and ((now - mtime_ns / 1e9) >= stable_time)
+
+################################################################################
+# Main
+################################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Post-process Movie Render Queue output while rendering")
+    parser.add_argument("render_dir", type=str, help="Render output directory with png/ and exr/ subdirectories")
+    parser.add_argument("framerate", type=int, nargs="?", default=30, help="Movie framerate (default: 30)")
+    parser.add_argument("rotate", nargs="?", choices=["rotate"], help="Generate movies in portrait mode")
+    parser.add_argument("--processes", type=int, default=DEFAULT_PROCESSES, help=f"Number of EXR processes (default: {DEFAULT_PROCESSES})")
+    parser.add_argument("--jobs", type=int, default=DEFAULT_JOBS, help=f"Number of concurrent movie encodes (default: {DEFAULT_JOBS})")
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS_PER_JOB, help=f"Encoder threads per movie encode (default: {DEFAULT_THREADS_PER_JOB})")
+    parser.add_argument("--movie-profile", choices=ENCODE_PROFILES.keys(), default="archive", help="Encode profile for movies, see create_movies_from_images.py (default: archive)")
+    parser.add_argument("--stable-time", type=float, default=DEFAULT_STABLE_TIME, help=f"Seconds a frame file must be unchanged before it is processed (default: {DEFAULT_STABLE_TIME})")
+    parser.add_argument("--sequence-timeout", type=float, default=DEFAULT_SEQUENCE_TIMEOUT, help=f"Seconds without new frames after which sequence is finalized (default: {DEFAULT_SEQUENCE_TIMEOUT})")
+    parser.add_argument("--exit-idle", type=float, default=0, help="Exit when render directory was idle for given seconds and all work is finished (default: 0, run until interrupted)")
+    parser.add_argument("--mask-format", choices=MASK_FORMATS, default="png", help="Segmentation mask output format, see exr_save_depth_masks.py (default: png)")
+    parser.add_argument("--depth-format", choices=DEPTH_FORMATS, default="exr32", help="Depth output format, see exr_save_depth_masks.py (default: exr32)")
+    parser.add_argument("--png-compression", type=int, choices=range(0, 10), default=DEFAULT_PNG_COMPRESSION, metavar="[0-9]", help=f"PNG zlib compression level for mask export (default: {DEFAULT_PNG_COMPRESSION})")
+    parser.add_argument("--png-encoder", choices=PNG_ENCODERS, default="default", help="PNG mask encoding, see exr_save_depth_masks.py (default: default)")
+    args = parser.parse_intermixed_args()
+
+    if OpenEXR is None:
+        print("ERROR: OpenEXR, OpenCV and NumPy are required, see Requirements of exr_save_depth_masks.py", file=sys.stderr)
+        sys.exit(1)
+
+    render_dir = Path(args.render_dir)
+    image_folder = render_dir / "png"
+    exr_folder = render_dir / "exr"
+    movie_folder = render_dir / "mp4"
+    rotate = args.rotate is not None
+
+    # Same options as exr_save_depth_masks.py batch mode so that completion manifests are shared
+    manifest_options = { "mask_format": args.mask_format, "png_compression": args.png_compression, "png_encoder": args.png_encoder, "depth_format": args.depth_format }
+    process_options = (args.mask_format, args.png_compression, args.png_encoder, args.depth_format)
+
+    print(f"Watching render directory: '{render_dir}'")
+    print(f"EXR processes: {args.processes}, movie encodes: {args.jobs} x {args.threads} threads")
+    print(f"Stable time: {args.stable_time}s, sequence timeout: {args.sequence_timeout}s, exit idle: {args.exit_idle}s")
+
+    sequences = {}
+    pending_frames = [] # (sequence name, EXR file name, (mtime_ns, size), AsyncResult)
+    pending_movies = {} # sequence name => Future
+    failures = {} # EXR file path or sequence name => error, each failed frame is reported once
+    processed = 0
+    last_activity = time.time()
+    start_time = time.perf_counter()
+
+    with Pool(args.processes) as pool, ThreadPoolExecutor(max_workers=args.jobs) as movie_executor:
+        try:
+            while True:
+                now = time.time()
+
+                sequence_names = set()
+                for folder in [image_folder, exr_folder]:
+                    if folder.is_dir():
+                        with os.scandir(folder) as entries:
+                            sequence_names.update(entry.name for entry in entries if entry.is_dir())
+
+                for sequence_name in sorted(sequence_names):
+                    if sequence_name not in sequences:
+                        sequences[sequence_name] = SequenceState(sequence_name, load_completion_manifest(get_completion_manifest_path(render_dir, sequence_name), manifest_options))
+                        print(f"New sequence: {sequence_name}")
+                    sequence = sequences[sequence_name]
+
+                    frame_stats = scan_frames(image_folder / sequence_name, ".png")
+                    frame_stats.update(scan_frames(exr_folder / sequence_name, ".exr"))
+                    if frame_stats != sequence.file_stats:
+                        sequence.last_activity = now
+                        last_activity = now
+                        if sequence.scanned and any((stat != sequence.file_stats.get(path)) for (path, stat) in frame_stats.items()):
+                            sequence.new_frames = True
+                        if sequence.finalized:
+                            print(f"WARNING: New frames in finalized sequence, will be finalized again: {sequence_name}")
+                            sequence.finalized = False
+
+                    for (path, stat) in frame_stats.items():
+                        if not is_stable(sequence.file_stats.get(path), stat, now, args.stable_time):
+                            continue
+
+                        name = os.path.basename(path)
+                        match = FRAME_PATTERN.search(name)
+                        if (match is not None) and (int(match.group(1)) < 0):
+                            try:
+                                os.remove(path) # warmup frame
+                            except FileNotFoundError:
+                                pass # already removed by renderer or other process
+                            continue
+
+                        if not name.endswith(".exr") or (name in sequence.submitted):
+                            continue
+
+                        frame = sequence.manifest.get(name)
+                        if (frame is not None) and (frame["mtime_ns"] == stat[0]) and (frame["size"] == stat[1]):
+                            continue
+
+                        if sequence.failed.get(name) == stat:
+                            continue
+
+                        task = ((Path(path), render_dir, True) + process_options, stat[0], stat[1])
+                        pending_frames.append( (sequence_name, name, stat, pool.apply_async(process_manifest_args, (task,))) )
+                        sequence.submitted.add(name)
+
+                    sequence.file_stats = frame_stats
+                    sequence.scanned = True
+
+                # Collect finished frames
+                still_pending = []
+                for (sequence_name, name, stat, result) in pending_frames:
+                    if not result.ready():
+                        still_pending.append( (sequence_name, name, stat, result) )
+                        continue
+
+                    sequence = sequences[sequence_name]
+                    sequence.submitted.discard(name)
+                    (input_exr, status, error, frame) = result.get()
+                    processed += 1
+                    if status:
+                        sequence.manifest[name] = frame
+                        sequence.failed.pop(name, None)
+                        failures.pop(str(input_exr), None)
+                    else:
+                        sequence.manifest.pop(name, None)
+                        sequence.failed[name] = stat
+                        failures[str(input_exr)] = error
+                        print(f"ERROR: {input_exr}: {error}", file=sys.stderr)
+                    sequence.manifest_modified = True
+                pending_frames = still_pending
+
+                for sequence in sequences.values():
+                    if sequence.manifest_modified:
+                        save_completion_manifest(get_completion_manifest_path(render_dir, sequence.name), manifest_options, sequence.manifest)
+                        sequence.manifest_modified = False
+
+                # Finalize idle sequences without pending frames
+                for sequence in sequences.values():
+                    if sequence.finalized or (len(sequence.submitted) > 0) or ((now - sequence.last_activity) < args.sequence_timeout):
+                        continue
+
+                    sequence.finalized = True
+                    print(f"Finalizing sequence: {sequence.name} [EXR frames: {len(sequence.manifest)}]")
+                    move_camera_exr(render_dir, sequence.name)
+
+                    image_dir = image_folder / sequence.name
+                    if image_dir.is_dir():
+                        output_path = movie_folder / get_output_name(image_dir, args.movie_profile)
+                        if output_path.exists() and (not sequence.new_frames):
+                            print(f"Skipping (movie exists): {output_path}")
+                        else:
+                            pending_movies[sequence.name] = movie_executor.submit(make_movie, image_dir, output_path, args.framerate, rotate, args.threads, args.movie_profile)
+                    sequence.new_frames = False
+
+                # Collect finished movies
+                for (sequence_name, future) in list(pending_movies.items()):
+                    if future.done():
+                        del pending_movies[sequence_name]
+                        if future.result():
+                            failures.pop(sequence_name, None)
+                            print(f"Movie finished: {sequence_name}")
+                        else:
+                            failures[sequence_name] = "Movie generation failed"
+
+                if (args.exit_idle > 0) and ((now - last_activity) >= args.exit_idle) and (len(pending_frames) == 0) and (len(pending_movies) == 0) and all(sequence.finalized for sequence in sequences.values()):
+                    print(f"Render directory idle for {args.exit_idle}s, exiting")
+                    break
+
+                time.sleep(POLL_INTERVAL)
+
+        except KeyboardInterrupt:
+            print("Interrupted, saving completion manifests", file=sys.stderr)
+            for sequence in sequences.values():
+                if sequence.manifest_modified:
+                    save_completion_manifest(get_completion_manifest_path(render_dir, sequence.name), manifest_options, sequence.manifest)
+            pool.terminate()
+            sys.exit(1)
+
+    print(f"Processed: {processed} EXR frames, sequences: {len(sequences)}, total time: {(time.perf_counter() - start_time):.1f}s", file=sys.stderr)
+    if len(failures) > 0:
+        print(f"ERROR: Post-processing errors: {len(failures)}", file=sys.stderr)
+        for (name, error) in failures.items():
+            print(f"  {name}: {error}", file=sys.stderr)
+        sys.exit(1)
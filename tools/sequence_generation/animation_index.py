@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 Max Planck Society
+# License: https://bedlam.is.tuebingen.mpg.de/license.html
+#
+# Animation metadata index for sequence generation
+#
+# + Stores frame count, root translation (trans) and quantized ground position of each frame for all whitelisted SMPL-X animations
+#   + Frame data of all animations: single memory-mapped .npy file (structured array, one record per frame)
+#   + Table of contents: .json file next to it, subject => animation => [frame offset, frames, motion_seq.npz mtime_ns, motion_seq.npz size]
+# + Index is built on first use from whitelist, animations are reloaded only when their motion_seq.npz modification time or size changed
+# + Worker processes open existing index with open_animation_index() without checking animation files again
+#
+# Usage: ./animation_index.py WHITELIST_JSON ANIMATION_FOLDER INDEX_PATH
+#
+
+import json
+import os
+from pathlib import Path
+import sys
+
+import numpy as np
+
+# Globals
+INDEX_VERSION = 1
+FRAME_DTYPE = np.dtype([ ("trans", "<f8", (3,)), ("point", "<i2", (2,)) ])
+
+# Ground position quantization, see get_image_coordinates_from_smplx() in be_generate_sequences_crowd.py
+DEFAULT_IMAGESIZE = 101
+DEFAULT_M_TO_PIXELS = 10
+
+def get_motion_path(animation_folder, subject, animation):
+    return Path(animation_folder) / subject / "moving_body_para" / animation / "motion_seq.npz"
+
+def get_toc_path(index_path):
+    return Path(index_path).with_suffix(".json")
+
+def get_ground_points(trans, imagesize=DEFAULT_IMAGESIZE, m_to_pixels=DEFAULT_M_TO_PIXELS):
+    # Quantized ground image coordinates (frames, 2) as (y, x) of root trajectory (frames, 3), same rounding (half to even) as get_image_coordinates_from_smplx()
+    image_center = (imagesize - 1) / 2
+    points_x = np.round(image_center + trans[:, 2] * m_to_pixels)
+    points_y = np.round(image_center - trans[:, 0] * m_to_pixels)
+    return np.stack((points_y, points_x), axis=1).astype(np.int64)
+
+class AnimationIndex:
+    def __init__(self, index_path, toc):
+        self.index_path = Path(index_path)
+        self.toc = toc
+        self.frames = np.load(self.index_path, mmap_mode="r")
+
+    def get_frames(self, subject, animation):
+        (offset, frames, _, _) = self.toc["animations"][subject][animation]
+        return self.frames[offset:(offset + frames)]
+
+    def get_num_frames(self, subject, animation):
+        return self.toc["animations"][subject][animation][1]
+
+    def get_trans(self, subject, animation):
+        return self.get_frames(subject, animation)["trans"]
+
+    def get_points(self, subject, animation):
+        return self.get_frames(subject, animation)["point"].astype(np.int64)
+
+def load_toc(index_path, imagesize, m_to_pixels):
+    # Returns table of contents if index exists and matches version and quantization settings, otherwise None
+    toc_path = get_toc_path(index_path)
+    if not (toc_path.exists() and Path(index_path).exists()):
+        return None
+
+    try:
+        with open(toc_path) as f:
+            toc = json.load(f)
+    except json.JSONDecodeError:
+        return None
+
+    if (toc.get("version") != INDEX_VERSION) or (toc.get("imagesize") != imagesize) or (toc.get("m_to_pixels") != m_to_pixels):
+        return None
+    return toc
+
+def save_index(index_path, toc, frames):
+    # Remove table of contents first so that an interrupted save invalidates the index instead of leaving inconsistent offsets
+    index_path = Path(index_path)
+    toc_path = get_toc_path(index_path)
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    toc_path.unlink(missing_ok=True)
+
+    tmp_index_path = index_path.with_name(index_path.name + ".tmp")
+    with open(tmp_index_path, "wb") as f:
+        np.save(f, frames)
+    os.replace(tmp_index_path, index_path)
+
+    tmp_toc_path = toc_path.with_name(toc_path.name + ".tmp")
+    with open(tmp_toc_path, "w") as f:
+        json.dump(toc, f)
+    os.replace(tmp_toc_path, toc_path)
+
+def load_animation_index(index_path, animation_folder, subject_animations, imagesize=DEFAULT_IMAGESIZE, m_to_pixels=DEFAULT_M_TO_PIXELS):
+    """
+    Open animation index for all animations of whitelist (subject => list of animations).
+    Missing animations are added and animations with modified motion_seq.npz are reloaded, index file is only rewritten on changes.
+    """
+    index_path = Path(index_path)
+    old_toc = load_toc(index_path, imagesize, m_to_pixels)
+    old_index = AnimationIndex(index_path, old_toc) if old_toc is not None else None
+
+    toc = { "version": INDEX_VERSION, "imagesize": imagesize, "m_to_pixels": m_to_pixels, "animations": {} }
+    frame_blocks = []
+    offset = 0
+    reused = 0
+    loaded = 0
+    for (subject, animations) in subject_animations.items():
+        for animation in animations:
+            motion_path = get_motion_path(animation_folder, subject, animation)
+            stat = motion_path.stat()
+
+            entry = None
+            if old_index is not None:
+                entry = old_index.toc["animations"].get(subject, {}).get(animation)
+
+            if (entry is not None) and (entry[2] == stat.st_mtime_ns) and (entry[3] == stat.st_size):
+                block = np.array(old_index.get_frames(subject, animation))
+                reused += 1
+            else:
+                with np.load(motion_path) as data:
+                    trans = data["trans"]
+                block = np.empty(len(trans), dtype=FRAME_DTYPE)
+                block["trans"] = trans
+                block["point"] = get_ground_points(trans, imagesize, m_to_pixels)
+                loaded += 1
+
+            toc["animations"].setdefault(subject, {})[animation] = [offset, len(block), stat.st_mtime_ns, stat.st_size]
+            frame_blocks.append(block)
+            offset += len(block)
+
+    if (old_toc is None) or (loaded > 0) or (old_toc["animations"] != toc["animations"]):
+        frames = np.concatenate(frame_blocks) if len(frame_blocks) > 0 else np.empty(0, dtype=FRAME_DTYPE)
+        del old_index # release memory map before replacing index file
+        save_index(index_path, toc, frames)
+        print(f"Animation index updated: {index_path} [reused: {reused}, loaded: {loaded}, frames: {offset}]", file=sys.stderr)
+
+    index = AnimationIndex(index_path, toc)
+    _open_indices[str(index_path)] = index
+    return index
+
+_open_indices = {}
+def open_animation_index(index_path):
+    # Open existing index once per process, does not check animation files
+    key = str(index_path)
+    if key not in _open_indices:
+        with open(get_toc_path(index_path)) as f:
+            toc = json.load(f)
+        _open_indices[key] = AnimationIndex(index_path, toc)
+    return _open_indices[key]
+
+################################################################################
+# Main
+################################################################################
+if __name__ == "__main__":
+    if len(sys.argv) != 4:
+        print(f"Usage: {sys.argv[0]} WHITELIST_JSON ANIMATION_FOLDER INDEX_PATH", file=sys.stderr)
+        sys.exit(1)
+
+    with open(sys.argv[1]) as f:
+        subject_animations = json.load(f)
+
+    index = load_animation_index(Path(sys.argv[3]), Path(sys.argv[2]), subject_animations)
+    num_animations = sum(len(animations) for animations in index.toc["animations"].values())
+    print(f"Animations: {num_animations}, frames: {len(index.frames)}")
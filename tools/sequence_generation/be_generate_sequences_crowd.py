@@ -9,18 +9,30 @@
 #
 # Notes: Run in unbuffered mode (-u) to immediately see results when piping stdout to tee
 #
+# Parallel generation (--processes N):
+# + Subjects and animations of all sequences are selected up front in the main process
+# + Body placement of each sequence attempt runs in a worker process with its own seed derived from the master seed
+# + Results are collected in attempt order so that the generated .csv is identical for any number of processes
+#
 
+import argparse
+from collections import OrderedDict, deque
+from contextlib import closing
 import copy
 import csv
 import cv2
 from dataclasses import dataclass
 import json
-from math import radians, tan
+from math import cos, radians, sin, tan
+from multiprocessing import Pool
 import numpy as np
 from pathlib import Path
+import queue
 import random
 import sys
+import threading
 
+from animation_index import load_animation_index, open_animation_index
 from be_generate_sequences_crowd_config import *
 
 # Globals
@@ -28,6 +40,22 @@ CV_IMAGESIZE = 101 # represents 10m distance with origin in center of image at (
 CV_M_TO_PIXELS = 10
 CV_BODY_RADIUS = 5  # 50cm body radius
 
+# Point based placement test: approximate smallest nonzero bilinear weight of OpenCV warpAffine fixed point interpolation (1/32 subpixel steps).
+# Floating point weights do not reproduce fixed point rounding, so footprints can differ from nonzero pixels of transform_image() output at their edges.
+CV_MIN_INTERPOLATION_WEIGHT = 1.0 / (32 * 32)
+CV_NEIGHBOR_OFFSETS = np.array([ (dx, dy) for dy in (-1, 0, 1) for dx in (-1, 0, 1) ], dtype=np.float64)
+
+# Ground trajectory image color table (20 entries, generated with distinctipy)
+RGB_COLORS = [(0.9719224153972289, 0.0006387120046262851, 0.9572435498906621), (0.0, 1.0, 0.0), (0.0, 0.5, 1.0), (1.0, 0.5, 0.0), (0.5, 0.75, 0.5), 
+              (0.30263956385061963, 0.02589151037218751, 0.6757257307743725), (0.8216012497248589, 0.0026428145851382645, 0.20847626796262153), (0.01267507572944171, 0.49697306807148534, 0.17396314179520123), (0.0, 1.0, 1.0), (0.9698728055826683, 0.5021762913810213, 0.7875501077376108), 
+              (1.0, 1.0, 0.0), (0.0, 1.0, 0.5), (0.510314116241271, 0.3232218781514624, 0.09891582182150804), (0.520147512582225, 0.8462498714551937, 0.00708852231806234), (0.5022640147541273, 0.3238721132368306, 0.9748299235270517), 
+              (0.5637646267468693, 0.7935494453374514, 0.9943913298776966), (0.9710018684130394, 0.8195424816067317, 0.46244870837979113), (0.26496132907909453, 0.38952992986967117, 0.5617810079535678), (0.0, 0.0, 1.0), (0.7026382639692401, 0.2676706088672629, 0.4941663340174245)]
+
+# Capsule based placement test: body radius [m] around root trajectory, see CV_BODY_RADIUS
+BODY_RADIUS = CV_BODY_RADIUS / CV_M_TO_PIXELS
+
+OCCUPANCY_CACHE_MAX_BYTES = 64 * 1024 * 1024 # per process, bit-packed 101x101 mask: 1276 bytes
+
 SMPLX_NPZ_ANIMATION_FOLDER = Path("/mnt/c/bedlam/animations/gendered_ground_truth")
 
 SUBJECT_GENDER_PATH = Path("../../config/gender.csv")               # Gender information for each subject
@@ -39,10 +67,12 @@ TEXTURES_CLOTHING_PATH = Path("../../config/textures_clothing.csv") # List of av
 
 animation_name = "kick"
 WHITELIST_PATH = Path(f"../../config/{animation_name}/whitelist_{animation_name}_animations.json")
+ANIMATION_INDEX_PATH = Path(f"cache/animation_index_{animation_name}.npy") # Frame counts and root trajectories of whitelisted animations, see animation_index.py
 
 WHITELIST_HAIR_PATH = Path("../../config/whitelist_hair.json")
 
 OUTPUT_IMAGE_ROOT = Path("images")
+IMAGE_QUEUE_SIZE = 64 # ground trajectory images waiting for background writer
 ################################################################################
 
 @dataclass
@@ -52,6 +82,7 @@ class SubjectLocationData:
     frames: int
     bounding_box_area: float
     trans: np.ndarray
+    points: np.ndarray
     image: np.ndarray
     x: float
     y: float
@@ -75,6 +106,74 @@ def get_image_coordinates_from_smplx(imagesize, animation_x, animation_z):
     image_y = round(image_center_y - animation_x * CV_M_TO_PIXELS)
     return (image_x, image_y)
 
+def get_occupancy_image(points):
+    # Ground occupancy mask of quantized animation root trajectory (frames, 2) as (y, x), see animation_index.get_ground_points(): filled body radius circle around each frame position.
+    # Quantized positions are deduplicated and rasterized with single dilation instead of drawing one circle per frame.
+    radius = CV_BODY_RADIUS
+    points = np.unique(points, axis=0)
+
+    # Circles of points outside the image can still reach into the image so we rasterize on padded image and crop afterwards
+    padded_size = CV_IMAGESIZE + 2 * radius
+    points += radius
+    inside = np.all((points >= 0) & (points < padded_size), axis=1)
+    points = points[inside]
+
+    point_image = np.zeros( (padded_size, padded_size), dtype=np.uint8)
+    point_image[points[:, 0], points[:, 1]] = 255
+
+    point_image = cv2.dilate(point_image, get_body_kernel(radius))
+    return point_image[radius:(radius + CV_IMAGESIZE), radius:(radius + CV_IMAGESIZE)].copy()
+
+_body_kernels = {}
+def get_body_kernel(radius):
+    # Disk kernel identical to cv2.circle() footprint with given radius
+    if radius not in _body_kernels:
+        kernel = np.zeros( (2 * radius + 1, 2 * radius + 1), dtype=np.uint8)
+        cv2.circle(kernel, (radius, radius), radius, 1, -1)
+        _body_kernels[radius] = kernel
+    return _body_kernels[radius]
+
+class OccupancyImageCache:
+    # LRU cache of bit-packed ground occupancy masks with memory bounded eviction
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        packed = self.entries.get(key)
+        if packed is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return np.unpackbits(packed, count=(CV_IMAGESIZE * CV_IMAGESIZE)).reshape(CV_IMAGESIZE, CV_IMAGESIZE) * np.uint8(255)
+
+    def put(self, key, image):
+        packed = np.packbits(image > 0)
+        self.entries[key] = packed
+        self.bytes += packed.nbytes
+        while (self.bytes > self.max_bytes) and (len(self.entries) > 1):
+            (_, evicted) = self.entries.popitem(last=False)
+            self.bytes -= evicted.nbytes
+            self.evictions += 1
+
+    def get_stats(self):
+        return (self.hits, self.misses, self.evictions)
+
+# Ground occupancy masks are reused whenever same animation subsequence is selected again, also in retried sequence attempts: (subject, animation, start frame, used frames) => mask
+_occupancy_image_cache = OccupancyImageCache(OCCUPANCY_CACHE_MAX_BYTES)
+def get_cached_occupancy_image(data):
+    key = (data.subject_name, data.animation_name, data.start_frame, data.used_frames)
+    image = _occupancy_image_cache.get(key)
+    if image is None:
+        image = get_occupancy_image(data.points[data.start_frame : (data.start_frame + data.used_frames)])
+        _occupancy_image_cache.put(key, image)
+    return image
+
 def get_image_offset_from_unreal(unreal_x, unreal_y):
     # Unreal coordinates: X-Up, Y-Right, [cm]
     # OpenCV coordinates: X-Right, Y-Down
@@ -101,20 +200,247 @@ def transform_image(source_image, unreal_x, unreal_y, unreal_yaw):
 
     return source_image_r_t
 
+def get_transform(unreal_x, unreal_y, unreal_yaw):
+    # Single rigid 2D transform (2x3) for ground occupancy mask, same rotation and integer translation as transform_image()
+    (t_x, t_y) = get_image_offset_from_unreal(unreal_x, unreal_y)
+    center = ( (CV_IMAGESIZE-1)/2, (CV_IMAGESIZE-1)/2 )
+    M = cv2.getRotationMatrix2D(center=center, angle=-unreal_yaw, scale=1)
+    M[:, 2] += (t_x, t_y) # integer translation
+    return M
+
+def get_transforms(unreal_x, unreal_y, unreal_yaw):
+    # Vectorized get_transform() for arrays of candidate locations, returns (K, 2, 3)
+    (t_x, t_y) = (np.round((unreal_y/100) * CV_M_TO_PIXELS), np.round((-unreal_x/100) * CV_M_TO_PIXELS))
+    center = (CV_IMAGESIZE-1)/2
+    angle = np.radians(-unreal_yaw)
+    (alpha, beta) = (np.cos(angle), np.sin(angle))
+
+    # cv2.getRotationMatrix2D()
+    M = np.empty( (len(angle), 2, 3), dtype=np.float64)
+    M[:, 0, 0] = alpha
+    M[:, 0, 1] = beta
+    M[:, 0, 2] = (1 - alpha) * center - beta * center + t_x
+    M[:, 1, 0] = -beta
+    M[:, 1, 1] = alpha
+    M[:, 1, 2] = beta * center + (1 - alpha) * center + t_y
+    return M
+
+def transform_points(points, M, footprint=True):
+    """
+    Point based approximation of transform_image() for ground occupancy mask.
+    points: (N, 2) image coordinates (x, y) of occupied pixels
+    M: Rigid transform from get_transform()
+    footprint: Expand transformed pixels to their approximate bilinear interpolation footprint (see CV_MIN_INTERPOLATION_WEIGHT),
+               otherwise only nearest output pixel of each transformed pixel is returned (subset of footprint).
+               Footprint pixels approximate nonzero pixels of warpAffine output and can differ at the edges.
+    Returns (K, 2) integer image coordinates (x, y), not clipped to image boundary, may contain duplicates.
+    """
+    # Forward transform of source pixel centers
+    transformed = points @ M[:, :2].T + M[:, 2]
+    if not footprint:
+        return np.round(transformed).astype(np.int64)
+
+    (candidates, covered) = get_footprints(transformed, M[:, :2])
+    return candidates[covered].astype(np.int64)
+
+def get_footprints(transformed, R):
+    """
+    Bilinear interpolation footprints of transformed pixel centers (..., N, 2) with rotation R (..., 2, 2).
+    Candidate output pixels are the 3x3 neighborhood of the transformed pixel centers.
+    Output pixel is covered if its inverse mapped location is within bilinear interpolation range of source pixel.
+    Returns (candidate pixels (..., N, 9, 2), covered (..., N, 9)).
+    """
+    candidates = np.round(transformed)[..., np.newaxis, :] + CV_NEIGHBOR_OFFSETS
+    offsets = (candidates - transformed[..., np.newaxis, :]) @ R[..., np.newaxis, :, :]
+    weights = np.maximum(1 - np.abs(offsets), 0)
+    covered = (weights[..., 0] * weights[..., 1]) >= CV_MIN_INTERPOLATION_WEIGHT
+    return (candidates, covered)
+
+def test_candidates(candidates, data_points, data_hull_points, occupancy_image_mask, safety_start, safety_end, offset):
+    """
+    Vectorized placement test for batch of candidate locations (K, 3): x, y, yaw.
+    Safety zone test uses approximate footprints, see transform_points(). Occupancy test only uses nearest output pixel of each transformed
+    trajectory pixel, candidates without detected overlap need to be checked with is_overlapping().
+    Returns (transforms (K, 2, 3), inside safety zone (K,), overlapping (K,)).
+    """
+    M = get_transforms(candidates[:, 0], candidates[:, 1], candidates[:, 2])
+
+    transformed_hull = data_hull_points @ np.swapaxes(M[:, :, :2], 1, 2) + M[:, np.newaxis, :, 2]
+    (hull_footprints, covered) = get_footprints(transformed_hull, M[:, :, :2])
+    hull_footprints += offset
+    outside = np.any((hull_footprints < safety_start) | (hull_footprints > safety_end), axis=-1) & covered
+    inside_safety_zone = ~np.any(outside, axis=(1, 2))
+
+    overlapping = np.zeros(len(candidates), dtype=bool)
+    if occupancy_image_mask is not None:
+        # Nearest output pixels of candidates inside safety zone
+        test_indices = np.flatnonzero(inside_safety_zone)
+        transformed = np.round(data_points @ np.swapaxes(M[test_indices, :, :2], 1, 2) + M[test_indices, np.newaxis, :, 2]).astype(np.int64)
+        inside_image = np.all((transformed >= 0) & (transformed < CV_IMAGESIZE), axis=-1)
+        transformed = np.clip(transformed, 0, CV_IMAGESIZE - 1)
+        hits = (occupancy_image_mask[transformed[..., 1], transformed[..., 0]] > 0) & inside_image
+        overlapping[test_indices] = np.any(hits, axis=1)
+
+    return (M, inside_safety_zone, overlapping)
+
+def get_points_mask(points, imagesize):
+    # Boolean mask for points which are inside square image
+    return np.all((points >= 0) & (points < imagesize), axis=1)
+
+def is_overlapping(occupancy_image_mask, points, hull_points):
+    """
+    Check if transformed trajectory pixels overlap occupancy mask.
+    points: Template trajectory pixels, transformed with transform_points(footprint=True) only if cheaper tests are inconclusive
+    hull_points: Transformed footprint of template trajectory convex hull. Footprints of all trajectory pixels lie within its bounding box.
+    """
+    (x_min, y_min) = np.maximum(hull_points.min(axis=0), 0)
+    (x_max, y_max) = hull_points.max(axis=0) + 1
+    if not np.any(occupancy_image_mask[y_min:y_max, x_min:x_max]):
+        return False
+
+    for footprint in [False, True]:
+        target_points = points(footprint)
+        target_points = target_points[get_points_mask(target_points, CV_IMAGESIZE)]
+        if np.any(occupancy_image_mask[target_points[:, 1], target_points[:, 0]]):
+            return True
+
+    return False
+
+def get_points_image(points):
+    image = np.zeros( (CV_IMAGESIZE, CV_IMAGESIZE), dtype=np.uint8)
+    points = points[get_points_mask(points, CV_IMAGESIZE)]
+    image[points[:, 1], points[:, 0]] = 255
+    return image
+
+def get_capsules(trans, capsule_length):
+    """
+    Approximate ground area of root trajectory (frames, 3) with swept body disks (capsules) in template ground coordinates [m].
+    Ground coordinates (x, y) = (animation z, -animation x) have same orientation as ground occupancy mask.
+    Consecutive frames are merged into one capsule until trajectory length capsule_length [m] is reached. Capsule radius is increased by
+    largest distance of merged frames from capsule segment so that capsules contain all body disks.
+    Returns (segment start points (N, 2), segment end points (N, 2), radii (N,)).
+    """
+    points = np.stack((trans[:, 2], -trans[:, 0]), axis=1)
+    lengths = np.concatenate(([0.0], np.cumsum(np.linalg.norm(np.diff(points, axis=0), axis=1))))
+
+    # Segment breakpoints: first frame at or after each multiple of capsule length and last frame
+    breaks = np.unique(np.concatenate((np.searchsorted(lengths, np.arange(0.0, lengths[-1], capsule_length)), [len(points) - 1])))
+    if len(breaks) == 1:
+        breaks = np.array([0, 0])
+    starts = points[breaks[:-1]]
+    ends = points[breaks[1:]]
+
+    segments = np.clip(np.searchsorted(breaks, np.arange(len(points)), side="right") - 1, 0, len(starts) - 1)
+    deviations = np.zeros(len(starts), dtype=np.float64)
+    np.maximum.at(deviations, segments, get_point_segment_distances(points, starts[segments], ends[segments]))
+    return (starts, ends, BODY_RADIUS + deviations)
+
+def transform_capsules(capsules, unreal_x, unreal_y, unreal_yaw):
+    # Continuous equivalent of get_transform() without pixel rounding: rotation around template origin and translation, [m]
+    (starts, ends, radii) = capsules
+    angle = radians(-unreal_yaw)
+    R = np.array([ [cos(angle), sin(angle)], [-sin(angle), cos(angle)] ])
+    t = np.array([unreal_y / 100, -unreal_x / 100])
+    return (starts @ R.T + t, ends @ R.T + t, radii)
+
+def get_capsule_bounds(capsules):
+    (starts, ends, radii) = capsules
+    return (np.minimum(starts, ends) - radii[:, np.newaxis], np.maximum(starts, ends) + radii[:, np.newaxis])
+
+def get_point_segment_distances(points, starts, ends):
+    segments = ends - starts
+    lengths_squared = np.maximum(np.sum(segments * segments, axis=-1), 1e-12)
+    t = np.clip(np.sum((points - starts) * segments, axis=-1) / lengths_squared, 0.0, 1.0)
+    offsets = points - (starts + t[..., np.newaxis] * segments)
+    return np.hypot(offsets[..., 0], offsets[..., 1])
+
+def is_segment_intersecting(starts_a, ends_a, starts_b, ends_b):
+    # Proper intersection of 2D line segments, touching and collinear segments are covered by point to segment distances
+    def cross(o, a, b):
+        return (a[..., 0] - o[..., 0]) * (b[..., 1] - o[..., 1]) - (a[..., 1] - o[..., 1]) * (b[..., 0] - o[..., 0])
+
+    return ((cross(starts_a, ends_a, starts_b) * cross(starts_a, ends_a, ends_b)) < 0) & ((cross(starts_b, ends_b, starts_a) * cross(starts_b, ends_b, ends_a)) < 0)
+
+def is_capsule_overlapping(placed_capsules, placed_bounds, capsules):
+    """
+    Check if candidate capsules overlap any capsule of placed bodies, placed_bounds: get_capsule_bounds() of placed capsules.
+    Broad phase: placed capsule bounding boxes against candidate body bounding box, then against candidate capsule bounding boxes.
+    Narrow phase: exact capsule distances of remaining capsule pairs, returns on first overlapping end disk.
+
+    Broad phase is a brute force test against all placed capsules. Placed bodies are limited to the 10m ground occupancy area
+    (at most 15 bodies in configs, typically below 1000 placed capsules) and one vectorized bounding box test over all of them is
+    faster than a uniform grid lookup, which only breaks even at around 5000 placed capsules.
+    """
+    (placed_min, placed_max) = placed_bounds
+    (capsules_min, capsules_max) = get_capsule_bounds(capsules)
+
+    near = np.flatnonzero(np.all((placed_min <= capsules_max.max(axis=0)) & (placed_max >= capsules_min.min(axis=0)), axis=1))
+    if len(near) == 0:
+        return False
+
+    pairs = np.all((placed_min[near, np.newaxis] <= capsules_max) & (placed_max[near, np.newaxis] >= capsules_min), axis=2)
+    (placed_indices, indices) = np.nonzero(pairs)
+    if len(indices) == 0:
+        return False
+    placed_indices = near[placed_indices]
+
+    (placed_starts, placed_ends, placed_radii) = (values[placed_indices] for values in placed_capsules)
+    (starts, ends, radii) = (values[indices] for values in capsules)
+    limits = placed_radii + radii
+
+    # Capsule distance is smallest end point to segment distance unless segments intersect
+    for (points, segment_starts, segment_ends) in [ (starts, placed_starts, placed_ends), (ends, placed_starts, placed_ends), (placed_starts, starts, ends), (placed_ends, starts, ends) ]:
+        if np.any(get_point_segment_distances(points, segment_starts, segment_ends) < limits):
+            return True
+
+    return np.any(is_segment_intersecting(placed_starts, placed_ends, starts, ends))
+
+def get_capsules_image(capsules):
+    # Rasterized capsules in ground occupancy mask coordinates
+    image = np.zeros( (CV_IMAGESIZE, CV_IMAGESIZE), dtype=np.uint8)
+    center = (CV_IMAGESIZE - 1) / 2
+    for (start, end, radius) in zip(*capsules):
+        start = tuple(int(value) for value in np.round(center + start * CV_M_TO_PIXELS))
+        end = tuple(int(value) for value in np.round(center + end * CV_M_TO_PIXELS))
+        radius = int(round(radius * CV_M_TO_PIXELS))
+        cv2.line(image, start, end, 255, 2 * radius + 1)
+        cv2.circle(image, start, radius, 255, -1)
+        cv2.circle(image, end, radius, 255, -1)
+    return image
+
+def get_ground_trajectories_image(targets, placement_test):
+    # Colored ground trajectory image of placed bodies, template trajectory center is at center of area boundary mask
+    occupancy_image = np.zeros( (CV_IMAGESIZE, CV_IMAGESIZE, 3), dtype=np.float64)
+    for (index, target) in enumerate(targets):
+        if placement_test == "points":
+            target_image = get_points_image(target)
+        elif placement_test == "capsules":
+            target_image = get_capsules_image(target)
+        else:
+            target_image = target
+        (r, g, b) = RGB_COLORS[index % len(RGB_COLORS)]
+        occupancy_image += cv2.cvtColor(target_image, cv2.COLOR_GRAY2BGR) * (b, g, r) # bgr
+
+    area_boundary_size = (CV_IMAGESIZE - 1) * 2 + 1
+    start = round((CV_IMAGESIZE - 1) / 2)
+    ground_trajectories = np.zeros( (area_boundary_size, area_boundary_size, 3), dtype=np.uint8)
+    ground_trajectories[start:(start + CV_IMAGESIZE), start:(start + CV_IMAGESIZE)] = occupancy_image
+    return ground_trajectories
+
+def get_location_data(c, used_subjects, used_animations, animation_index_path, trajectory_image=True):
+    # Returns (location data, ground trajectory image or None if not requested) or None if bodies could not be placed
+    animation_index = open_animation_index(animation_index_path)
 
-def get_location_data(c, grouptype, sequence_index, used_subjects, used_animations, animation_folder):
     location_data = []
     for index, subject in enumerate(used_subjects):
         animation_name = used_animations[index]
 
-        # Load animation data
-        filepath = animation_folder / subject / "moving_body_para" / animation_name / "motion_seq.npz"
-
-        with np.load(filepath) as data:
-            trans = data["trans"]
-            frames = len(trans)
+        # Get animation data from memory-mapped animation index instead of loading motion_seq.npz
+        trans = animation_index.get_trans(subject, animation_name)
+        points = animation_index.get_points(subject, animation_name)
+        frames = len(trans)
 
-        data = SubjectLocationData(subject, animation_name, frames, 0.0, trans, None, 0, 0, 0, 0, 0)
+        data = SubjectLocationData(subject, animation_name, frames, 0.0, trans, points, None, 0, 0, 0, 0, 0)
         location_data.append(data)
 
     # Find shortest animation sequence length
@@ -151,23 +477,19 @@ def get_location_data(c, grouptype, sequence_index, used_subjects, used_animatio
                     location_data_areasorted.append(data)
                     break
 
-    # Generate ground occupancy masks for unmodified animations
+    # Generate ground occupancy masks for unmodified animations, capsules placement test does not need them
     for data in location_data_areasorted:
-        radius = CV_BODY_RADIUS
-        current_location_image = np.zeros( (CV_IMAGESIZE, CV_IMAGESIZE), dtype=np.uint8)
-        trans = data.trans[data.start_frame : (data.start_frame + data.used_frames), :]
-        for position in trans:
-            # Mark occupied area
-            circle_center = get_image_coordinates_from_smplx(CV_IMAGESIZE, position[0], position[2])
-            cv2.circle(current_location_image, circle_center, radius, 255, -1)
+        if c.placement_test == "capsules":
+            continue
+        data.image = get_cached_occupancy_image(data)
 
         # Debug image output
-        #cv2.imwrite(f"{data.subject_name}_{data.animation_name}.png", current_location_image)
-
-        # Store image
-        data.image = current_location_image
+        #cv2.imwrite(f"{data.subject_name}_{data.animation_name}.png", data.image)
 
     # Find target locations
+    occupancy_image_mask = np.zeros( (CV_IMAGESIZE, CV_IMAGESIZE), dtype=np.uint8)
+    placed_capsules = None
+    targets = [] # placed bodies: transformed trajectory pixels (points placement test), transformed capsules (capsules placement test) or transformed trajectory mask (image placement test)
     for (index, data) in enumerate(location_data_areasorted):
         print(f"  Processing: {data.subject_name}_{data.animation_name}", file=sys.stderr)
 
@@ -186,7 +508,7 @@ def get_location_data(c, grouptype, sequence_index, used_subjects, used_animatio
         cv2.rectangle(area_boundary_mask, (safety_start_x, safety_start_y), (safety_end_x, safety_end_y), 0, -1)
         #cv2.imwrite(f"area_boundary_mask.png", area_boundary_mask)
 
-        target_image = None
+        target = None
         target_image_location_test_index = 1
         safety_zone_test_index = 1
         x_min = c.x_min
@@ -196,8 +518,25 @@ def get_location_data(c, grouptype, sequence_index, used_subjects, used_animatio
 
         start_x = round((CV_IMAGESIZE-1)/2)
         start_y = start_x
-
-        while target_image is None:
+        (height, width) = (CV_IMAGESIZE, CV_IMAGESIZE)
+
+        if c.placement_test == "capsules":
+            # Continuous ground coordinates [m], safety zone contains capsule if it contains both capsule end disks
+            data_capsules = get_capsules(data.trans[data.start_frame : (data.start_frame + data.used_frames), :], c.capsule_length / 100)
+            safety_zone_half_width = c.safety_zone_width / 200
+        elif c.placement_test == "points":
+            # Occupied pixel coordinates (x, y) of template trajectory and its convex hull
+            data_points = np.argwhere(data.image)[:, ::-1].astype(np.float64)
+            data_hull_points = cv2.convexHull(data_points.astype(np.int32)).reshape(-1, 2).astype(np.float64)
+
+        # Batched candidate sampling: Draw candidate_batch_size locations at once from NumPy generator seeded from global random state
+        # and test them vectorized. Candidates are consumed in order so that trial counters behave like sequential sampling.
+        batch_size = c.candidate_batch_size
+        if batch_size > 1:
+            rng = np.random.default_rng(random.getrandbits(64))
+        batch = []
+
+        while target is None:
             if target_image_location_test_index % 5000 == 0:
                 offset = 10
                 x_min -= offset
@@ -205,77 +544,108 @@ def get_location_data(c, grouptype, sequence_index, used_subjects, used_animatio
                 y_min -= offset
                 y_max += offset
                 print(f"  Increasing body area: Location trial={target_image_location_test_index}, x=[{x_min}, {x_max}], y=[{y_min}, {y_max}]", file=sys.stderr)
+                batch = [] # drop candidates from previous area
 
             # Give up if we cannot find safety zone location within reasonable time
             if safety_zone_test_index % 5000 == 0:
                 print(f"  WARNING: Safety zone test failed: Zone trial={safety_zone_test_index}", file=sys.stderr)
                 return None
 
-            x = random.uniform(x_min, x_max)
-            y = random.uniform(y_min, y_max)
-            yaw = random.uniform(c.yaw_min, c.yaw_max)
-
-            ground_trajectory_mask = np.zeros( (area_boundary_size, area_boundary_size), dtype=np.uint8)
-            height, width = data.image.shape
-            # Copy current template trajectory in larger mask at center
-            ground_trajectory_mask[start_y:(start_y + height), start_x:(start_x + width)] = data.image
+            batch_inside_safety_zone = None
+            batch_overlapping = False
+            if batch_size > 1:
+                if len(batch) == 0:
+                    candidates = np.stack( (rng.uniform(x_min, x_max, batch_size), rng.uniform(y_min, y_max, batch_size), rng.uniform(c.yaw_min, c.yaw_max, batch_size)), axis=1)
+                    if c.placement_test == "points":
+                        (M, inside, overlapping) = test_candidates(candidates, data_points, data_hull_points, occupancy_image_mask if index > 0 else None, safety_start_x, safety_end_x, start_x)
+                        batch = list(zip(candidates.tolist(), M, inside, overlapping))
+                    else:
+                        batch = [ (candidate, None, None, False) for candidate in candidates.tolist() ]
+                    batch.reverse() # pop() in drawing order
+
+                ((x, y, yaw), M, batch_inside_safety_zone, batch_overlapping) = batch.pop()
+            else:
+                x = random.uniform(x_min, x_max)
+                y = random.uniform(y_min, y_max)
+                yaw = random.uniform(c.yaw_min, c.yaw_max)
+                M = None
+
+            if c.placement_test == "capsules":
+                target_capsules = transform_capsules(data_capsules, x, y, yaw)
+                (target_starts, target_ends, target_radii) = target_capsules
+                inside_safety_zone = np.all(np.abs(target_starts) + target_radii[:, np.newaxis] <= safety_zone_half_width) and np.all(np.abs(target_ends) + target_radii[:, np.newaxis] <= safety_zone_half_width)
+            elif c.placement_test == "points":
+                # Test boundary and occupancy on transformed pixel coordinates instead of warped images
+                if M is None:
+                    M = get_transform(x, y, yaw)
+
+                if batch_inside_safety_zone is not None:
+                    inside_safety_zone = batch_inside_safety_zone
+                else:
+                    # Safety zone is convex so it contains all transformed trajectory pixels if it contains the transformed convex hull pixels.
+                    # Footprints are approximate (see transform_points()), decisions can differ from image placement test near the safety zone boundary.
+                    # Boundary mask has same center as template trajectory. Note: Pixels outside of boundary mask are treated as outside of safety zone.
+                    boundary_points = transform_points(data_hull_points, M) + start_x
+                    inside_safety_zone = np.all((boundary_points >= safety_start_x) & (boundary_points <= safety_end_x))
+            else:
+                ground_trajectory_mask = np.zeros( (area_boundary_size, area_boundary_size), dtype=np.uint8)
+                # Copy current template trajectory in larger mask at center
+                ground_trajectory_mask[start_y:(start_y + height), start_x:(start_x + width)] = data.image
 
 
-            ground_trajectory_mask_r_t = transform_image(ground_trajectory_mask, x, y, yaw)
+                ground_trajectory_mask_r_t = transform_image(ground_trajectory_mask, x, y, yaw)
 
-            area_mask_test = cv2.bitwise_and(area_boundary_mask, ground_trajectory_mask_r_t)
-            #cv2.imwrite(f"test_r_t_{index}_masked.png", area_mask_test)
+                area_mask_test = cv2.bitwise_and(area_boundary_mask, ground_trajectory_mask_r_t)
+                #cv2.imwrite(f"test_r_t_{index}_masked.png", area_mask_test)
+                inside_safety_zone = not np.any(area_mask_test)
 
-            if not np.any(area_mask_test):
+            if inside_safety_zone:
                 target_image_location_test_index += 1
                 # No overlap with outside boundary, we have valid area trajectory and can do occupancy overlap check next
-                target_image = transform_image(data.image, x, y, yaw)
+                if c.placement_test == "capsules":
+                    if (index > 0) and is_capsule_overlapping(placed_capsules, placed_bounds, target_capsules):
+                        continue
 
-                if index > 0:
-                    occupancy_test = cv2.bitwise_and(occupancy_image_mask, target_image)
-                    if np.any(occupancy_test):
+                    target = target_capsules
+                elif c.placement_test == "points":
+                    if (index > 0) and (batch_overlapping or is_overlapping(occupancy_image_mask, lambda footprint: transform_points(data_points, M, footprint), transform_points(data_hull_points, M))):
                         # Failed test, we are overlapping, need to try with new location
-                        target_image = None
                         continue
+
+                    target = transform_points(data_points, M)
+                    target = target[get_points_mask(target, CV_IMAGESIZE)]
+                else:
+                    target = transform_image(data.image, x, y, yaw)
+
+                    if index > 0:
+                        occupancy_test = cv2.bitwise_and(occupancy_image_mask, target)
+                        if np.any(occupancy_test):
+                            # Failed test, we are overlapping, need to try with new location
+                            target = None
+                            continue
                 
                 # Valid trajectory without occupancy overlap found
                 data.x = x
                 data.y = y
                 data.yaw = yaw
-                #cv2.imwrite(f"target_image.png", target_image)
                 continue
             else:
                 # Safety zone test failed
                 safety_zone_test_index += 1
 
-        # Color table (20 entries, generated with distinctipy)
-        rgb_colors = [(0.9719224153972289, 0.0006387120046262851, 0.9572435498906621), (0.0, 1.0, 0.0), (0.0, 0.5, 1.0), (1.0, 0.5, 0.0), (0.5, 0.75, 0.5), 
-                      (0.30263956385061963, 0.02589151037218751, 0.6757257307743725), (0.8216012497248589, 0.0026428145851382645, 0.20847626796262153), (0.01267507572944171, 0.49697306807148534, 0.17396314179520123), (0.0, 1.0, 1.0), (0.9698728055826683, 0.5021762913810213, 0.7875501077376108), 
-                      (1.0, 1.0, 0.0), (0.0, 1.0, 0.5), (0.510314116241271, 0.3232218781514624, 0.09891582182150804), (0.520147512582225, 0.8462498714551937, 0.00708852231806234), (0.5022640147541273, 0.3238721132368306, 0.9748299235270517), 
-                      (0.5637646267468693, 0.7935494453374514, 0.9943913298776966), (0.9710018684130394, 0.8195424816067317, 0.46244870837979113), (0.26496132907909453, 0.38952992986967117, 0.5617810079535678), (0.0, 0.0, 1.0), (0.7026382639692401, 0.2676706088672629, 0.4941663340174245)]
-
-        if index == 0:
-            occupancy_image_mask = target_image.copy()
-
-            (r, g, b) = rgb_colors[index % len(rgb_colors)]
-            occupancy_image = cv2.cvtColor(target_image, cv2.COLOR_GRAY2BGR) * (b, g, r) # bgr
+        # Add placed body to occupancy mask in place, colored ground trajectory image is only rendered when requested
+        if c.placement_test == "capsules":
+            placed_capsules = target if placed_capsules is None else tuple(np.concatenate(values) for values in zip(placed_capsules, target))
+            placed_bounds = get_capsule_bounds(placed_capsules)
+        elif c.placement_test == "points":
+            occupancy_image_mask[target[:, 1], target[:, 0]] = 255
         else:
-            occupancy_image_mask = cv2.bitwise_or(occupancy_image_mask, target_image)
-
-            (r, g, b) = rgb_colors[index % len(rgb_colors)]
-            occupancy_image = occupancy_image + cv2.cvtColor(target_image, cv2.COLOR_GRAY2BGR) * (b, g, r) # bgr
-
-        #cv2.imwrite(f"occupancy_image.png", occupancy_image)
-
-    # Add camera frustum and save accumulated ground trajectory image
-    ground_trajectories = np.zeros( (area_boundary_size, area_boundary_size, 3), dtype=np.uint8)
-    ground_trajectories[start_y:(start_y + height), start_x:(start_x + width)] = occupancy_image
+            cv2.bitwise_or(occupancy_image_mask, target, dst=occupancy_image_mask)
+        targets.append(target)
 
-    output_root = OUTPUT_IMAGE_ROOT / grouptype / "ground_trajectories"
-    output_root.mkdir(parents=True, exist_ok=True)
-    output_image_path = output_root / f"ground_trajectories_{sequence_index:06d}.png"
-#    cv2.imwrite(str(output_image_path), occupancy_image)
-    cv2.imwrite(str(output_image_path), ground_trajectories)
+    ground_trajectories = None
+    if trajectory_image:
+        ground_trajectories = get_ground_trajectories_image(targets, c.placement_test)
 
     # Adjust sequence lengths for proper motion blur at beginning and end
     for data in location_data:
@@ -290,22 +660,27 @@ def get_location_data(c, grouptype, sequence_index, used_subjects, used_animatio
         # Decrement end frame for proper temporal sampling on last image frame
         data.used_frames -= 1
 
-    return location_data
+    return (location_data, ground_trajectories)
 
-def get_sequences(c, grouptype, subject_animations, animation_folder):
-    num_sequences = c.num_sequences
+def get_seed(master_seed, *keys):
+    # Independent deterministic seed for given master seed and keys
+    return int(np.random.SeedSequence([master_seed, *keys]).generate_state(1, dtype=np.uint64)[0])
 
-    sequences = []
+def get_sequence_tasks(c, subject_animations, animation_index_path, master_seed, trajectory_images):
+    """
+    Select subjects and animations for all sequence attempts, independent of body placement results.
+    Yields task tuples for generate_sequence() with per-attempt placement seed.
+    """
+    rng = random.Random(get_seed(master_seed, 0))
     subjects = list(subject_animations.keys())
 
     if c.unique_sequences:
         input_subjects = list(subjects)
         input_subject_animations = copy.deepcopy(subject_animations)
 
-    sequence_index = 0
-    while sequence_index < num_sequences:
-        print(f"Generating sequence: {sequence_index}", file=sys.stderr)
-        num_subjects = random.randint(c.bodies_min, c.bodies_max)
+    attempt_index = 0
+    while True:
+        num_subjects = rng.randint(c.bodies_min, c.bodies_max)
 
         if c.unique_sequences:
             if len(subjects) < num_subjects:
@@ -319,7 +694,7 @@ def get_sequences(c, grouptype, subject_animations, animation_folder):
         for _ in range(num_subjects):
             # Select target subjects, avoid same subject in same sequence if requested
             # Note: We treat rp_aaron_posed_002 and rp_aaron_posed_009 as different subjects due to different clothing
-            current_subject_index = random.randint(0, len(current_subjects)-1)
+            current_subject_index = rng.randint(0, len(current_subjects)-1)
             current_subject = current_subjects[current_subject_index]
             if c.unique_subjects:
                 # Remove selected subject from current_subjects so that it will not be selected on following iterations
@@ -329,16 +704,13 @@ def get_sequences(c, grouptype, subject_animations, animation_folder):
 
             # Find animation for current subject
             current_animations = subject_animations[current_subject]
-            current_animation_index = random.randint(0, len(current_animations)-1)
+            current_animation_index = rng.randint(0, len(current_animations)-1)
             current_animation = current_animations[current_animation_index]
 
             used_animations.append(current_animation)
 
-        # Get sequence bodies location data, sorted by ground area coverage, largest first
-        subject_location_data = get_location_data(c, grouptype, sequence_index, used_subjects, used_animations, animation_folder)
-        if subject_location_data is not None:
-            sequences.append( (f"seq_{sequence_index:06d}", subject_location_data) )
-            sequence_index += 1
+        yield (c, get_seed(master_seed, 1, attempt_index), used_subjects, used_animations, animation_index_path, trajectory_images)
+        attempt_index += 1
 
         if c.unique_sequences:
             # Remove used subjects and animations
@@ -350,6 +722,80 @@ def get_sequences(c, grouptype, subject_animations, animation_folder):
 
                 subjects.remove(used_subject)
 
+def generate_sequence(task):
+    # Returns (get_location_data() result, occupancy mask cache statistics of this task) so that statistics of worker processes can be accumulated
+    (c, seed, used_subjects, used_animations, animation_index_path, trajectory_image) = task
+    random.seed(seed)
+    stats = _occupancy_image_cache.get_stats()
+    result = get_location_data(c, used_subjects, used_animations, animation_index_path, trajectory_image)
+    return (result, np.subtract(_occupancy_image_cache.get_stats(), stats))
+
+def generate_sequences(tasks, processes):
+    # Yields generate_sequence() results in task order, keeps at most two tasks per process in flight
+    if processes <= 1:
+        for task in tasks:
+            yield generate_sequence(task)
+        return
+
+    with Pool(processes) as pool:
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.apply_async(generate_sequence, (task,)))
+            if len(pending) >= (2 * processes):
+                yield pending.popleft().get()
+
+        while len(pending) > 0:
+            yield pending.popleft().get()
+
+def write_images(image_queue):
+    # Background image writer, (path, image) items, stops on None
+    while True:
+        item = image_queue.get()
+        if item is None:
+            break
+        (image_path, image) = item
+        if not cv2.imwrite(str(image_path), image):
+            print(f"ERROR: Cannot write image: {image_path}", file=sys.stderr)
+
+def get_sequences(c, grouptype, subject_animations, animation_index_path, master_seed, processes=1, trajectory_images=True):
+    num_sequences = c.num_sequences
+    sequences = []
+
+    # Ground trajectory images are encoded and saved in background thread so that placement does not wait for disk
+    if trajectory_images:
+        output_root = OUTPUT_IMAGE_ROOT / grouptype / "ground_trajectories"
+        output_root.mkdir(parents=True, exist_ok=True)
+        image_queue = queue.Queue(maxsize=IMAGE_QUEUE_SIZE)
+        image_writer = threading.Thread(target=write_images, args=(image_queue,))
+        image_writer.start()
+
+    cache_stats = np.zeros(3, dtype=np.int64)
+    tasks = get_sequence_tasks(c, subject_animations, animation_index_path, master_seed, trajectory_images)
+    try:
+        with closing(generate_sequences(tasks, processes)) as results:
+            for (result, stats) in results:
+                cache_stats += stats
+                if result is None:
+                    continue
+
+                # Sequence bodies location data, sorted by ground area coverage, largest first
+                (subject_location_data, ground_trajectories) = result
+                sequence_index = len(sequences)
+                print(f"Generated sequence: {sequence_index}", file=sys.stderr)
+
+                if trajectory_images:
+                    image_queue.put( (output_root / f"ground_trajectories_{sequence_index:06d}.png", ground_trajectories) )
+
+                sequences.append( (f"seq_{sequence_index:06d}", subject_location_data) )
+                if len(sequences) == num_sequences:
+                    break
+    finally:
+        if trajectory_images:
+            image_queue.put(None)
+            image_writer.join()
+
+    (hits, misses, evictions) = cache_stats
+    print(f"Occupancy mask cache: hits: {hits}, misses: {misses}, evictions: {evictions}, hit rate: {hits / max(1, hits + misses):.1%}", file=sys.stderr)
     return sequences
 
 
@@ -357,22 +803,31 @@ def get_sequences(c, grouptype, subject_animations, animation_folder):
 # Main
 ################################################################################
 if __name__ == "__main__":
-    if len(sys.argv) < 2 or len(sys.argv) > 3:
-        print(f"Usage: {sys.argv[0]} GROUPTYPE [HDRI_PATH]", file=sys.stderr)
-        print(configs.keys())
-        sys.exit(1)
-
-    grouptype = sys.argv[1]
+    parser = argparse.ArgumentParser(description="Generate .csv file with body positions for multiple animated people per sequence")
+    parser.add_argument("grouptype", type=str, help=f"Sequence group configuration: {list(configs.keys())}")
+    parser.add_argument("hdris_path", type=str, nargs="?", default=None, help="Optional list of HDR images for IBL rendering")
+    parser.add_argument("--processes", type=int, default=1, help="Number of processes for body placement (default: 1)")
+    parser.add_argument("--seed", type=int, default=None, help="Master random seed, overrides configuration seed (default: configuration seed or random)")
+    parser.add_argument("--no-trajectory-images", dest="trajectory_images", action="store_false", help="Do not save ground trajectory debug images to images/GROUPTYPE/ground_trajectories")
+    args = parser.parse_args()
+
+    grouptype = args.grouptype
     if not grouptype in configs:
         print(f"ERROR: Undefined group type: {grouptype}", file=sys.stderr)
         sys.exit(1)
     c = configs[grouptype]
 
+    master_seed = args.seed if args.seed is not None else c.seed
+    if master_seed is None:
+        master_seed = random.randrange(2**32)
+    elif master_seed < 0:
+        print(f"ERROR: Master seed must be non-negative: {master_seed}", file=sys.stderr)
+        sys.exit(1)
+    print(f"Master seed: {master_seed}", file=sys.stderr)
+
     whitelist_path = WHITELIST_PATH
 
-    hdris_path = None
-    if len(sys.argv) > 2:
-        hdris_path = sys.argv[2]
+    hdris_path = args.hdris_path
 
     # Get list of whitelisted subject animations
     subject_animations = {}
@@ -433,8 +888,14 @@ if __name__ == "__main__":
     with open(WHITELIST_HAIR_PATH) as f:
         whitelist_hair = json.load(f)
 
+    # Build or update animation index of whitelisted animations
+    load_animation_index(ANIMATION_INDEX_PATH, SMPLX_NPZ_ANIMATION_FOLDER, subject_animations, CV_IMAGESIZE, CV_M_TO_PIXELS)
+
     # Get sequences
-    sequences = get_sequences(c, grouptype, subject_animations, SMPLX_NPZ_ANIMATION_FOLDER)
+    sequences = get_sequences(c, grouptype, subject_animations, ANIMATION_INDEX_PATH, master_seed, args.processes, args.trajectory_images)
+
+    # Texture, clothing and hair selection
+    random.seed(get_seed(master_seed, 2))
 
     index = 0
     print("Index,Type,Body,X,Y,Z,Yaw,Pitch,Roll,Comment")
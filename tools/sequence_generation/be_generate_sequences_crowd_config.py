@@ -25,6 +25,10 @@ class Config(NamedTuple):
     override_cameraroot_location: bool = False
     safety_zone_width: float = 1000
     use_hair: bool = False
+    placement_test: str = "image" # body placement test: warped occupancy mask images (image), faster approximation on transformed occupied pixel coordinates (points) or continuous swept body capsules (capsules)
+    capsule_length: float = 20.0 # [cm], capsules placement test: trajectory length covered by one capsule, smaller values follow curved trajectories more tightly
+    candidate_batch_size: int = 1 # >1: draw and test this many placement candidates at once (NumPy, vectorized for points placement test)
+    seed: int = None # master random seed for reproducible sequences independent of --processes, None: random
 configs = {}
 
 # be_1: 1 person in 8m x 8m area with center at camera distance 10m
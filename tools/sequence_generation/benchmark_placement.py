@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# Copyright (c) 2023 Max Planck Society
+# License: https://bedlam.is.tuebingen.mpg.de/license.html
+#
+# Benchmark body placement tests of be_generate_sequences_crowd.py
+#
+# + Generates sequences of given group configuration once per placement test (points, image, capsules) with same master seed
+# + Reports sequence acceptance rate (generated sequences / sequence attempts) and generated sequences per second
+# + Ground trajectory images are not generated
+#
+# Usage: ./benchmark_placement.py GROUPTYPE [--sequences N] [--tests points image capsules] [--seed SEED]
+#
+
+import argparse
+from contextlib import closing
+import copy
+import json
+from pathlib import Path
+import sys
+import time
+
+import be_generate_sequences_crowd as crowd
+from animation_index import load_animation_index
+from be_generate_sequences_crowd_config import configs
+
+# Globals
+PLACEMENT_TESTS = ["points", "image", "capsules"]
+
+def run_benchmark(c, subject_animations, animation_index_path, master_seed, processes):
+    # Returns (generated sequences, sequence attempts, duration [s])
+    crowd._occupancy_image_cache = crowd.OccupancyImageCache(crowd.OCCUPANCY_CACHE_MAX_BYTES)
+
+    sequences = 0
+    attempts = 0
+    start_time = time.perf_counter()
+    tasks = crowd.get_sequence_tasks(c, copy.deepcopy(subject_animations), animation_index_path, master_seed, False)
+    with closing(crowd.generate_sequences(tasks, processes)) as results:
+        for (result, _) in results:
+            attempts += 1
+            if result is not None:
+                sequences += 1
+                if sequences == c.num_sequences:
+                    break
+    return (sequences, attempts, time.perf_counter() - start_time)
+
+################################################################################
+# Main
+################################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark body placement tests of be_generate_sequences_crowd.py")
+    parser.add_argument("grouptype", type=str, help=f"Sequence group configuration: {list(configs.keys())}")
+    parser.add_argument("--sequences", type=int, default=None, help="Number of sequences per placement test (default: num_sequences of configuration)")
+    parser.add_argument("--tests", nargs="+", choices=PLACEMENT_TESTS, default=PLACEMENT_TESTS, help="Placement tests to benchmark (default: all)")
+    parser.add_argument("--batch-size", type=int, default=None, help="Candidate batch size (default: candidate_batch_size of configuration)")
+    parser.add_argument("--processes", type=int, default=1, help="Number of processes for body placement (default: 1)")
+    parser.add_argument("--seed", type=int, default=0, help="Master random seed (default: 0)")
+    parser.add_argument("--whitelist", type=str, default=str(crowd.WHITELIST_PATH), help=f"Animation whitelist (default: {crowd.WHITELIST_PATH})")
+    parser.add_argument("--animation-folder", type=str, default=str(crowd.SMPLX_NPZ_ANIMATION_FOLDER), help=f"SMPL-X animation folder (default: {crowd.SMPLX_NPZ_ANIMATION_FOLDER})")
+    parser.add_argument("--index", type=str, default=str(crowd.ANIMATION_INDEX_PATH), help=f"Animation index path (default: {crowd.ANIMATION_INDEX_PATH})")
+    args = parser.parse_args()
+
+    if not args.grouptype in configs:
+        print(f"ERROR: Undefined group type: {args.grouptype}", file=sys.stderr)
+        sys.exit(1)
+    c = configs[args.grouptype]
+    if args.seed < 0:
+        print(f"ERROR: Master seed must be non-negative: {args.seed}", file=sys.stderr)
+        sys.exit(1)
+    if args.sequences is not None:
+        c = c._replace(num_sequences=args.sequences)
+    if args.batch_size is not None:
+        c = c._replace(candidate_batch_size=args.batch_size)
+
+    with open(args.whitelist) as f:
+        subject_animations = { subject: animations for (subject, animations) in json.load(f).items() if len(animations) > 0 }
+
+    animation_index_path = Path(args.index)
+    load_animation_index(animation_index_path, Path(args.animation_folder), subject_animations, crowd.CV_IMAGESIZE, crowd.CV_M_TO_PIXELS)
+
+    print(f"Benchmark: {args.grouptype}, sequences: {c.num_sequences}, bodies: [{c.bodies_min}, {c.bodies_max}], candidate batch size: {c.candidate_batch_size}, processes: {args.processes}")
+    for placement_test in args.tests:
+        (sequences, attempts, duration) = run_benchmark(c._replace(placement_test=placement_test), subject_animations, animation_index_path, args.seed, args.processes)
+        print(f"{placement_test:8}: sequences: {sequences}, attempts: {attempts}, acceptance rate: {sequences / max(1, attempts):.1%}, time: {duration:.1f}s, sequences/s: {sequences / duration:.2f}")